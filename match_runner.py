@@ -0,0 +1,275 @@
+"""
+Запуск матчей без интерфейса и замер производительности стратегии.
+
+Каждый матч играется в отдельном процессе. Состояние команды хранится в голове (Head), своей для каждой игры,
+но движок держит сцену и часть статистики в атрибутах классов, поэтому матчи в одном процессе мешали бы друг другу.
+
+Пример:
+    python match_runner.py --seeds 1-8 --opponent collector --processes 4
+    python match_runner.py --seeds 1,2,3 --opponent some_module:SomeDrone --json result.json
+    python match_runner.py --seeds 1-4 --memory
+    python match_runner.py --seeds 1-4 --trace traces
+    python match_runner.py --seeds 1-8 --place-search grid   # сравнить с --place-search vector
+
+Для каждого матча считаются сборки мусора по поколениям (нагрузка на сборщик мусора от временных объектов),
+с --memory еще и пик памяти по tracemalloc (матч при этом заметно медленнее).
+"""
+import argparse
+import contextlib
+import gc
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def builtin_opponent(name):
+    """
+    Встроенные соперники
+
+    :param name: collector - собирает элериум с случайных астероидов и во время погрузки и разгрузки
+     стреляет по ближайшему противнику; idle - ничего не делает
+    :return: класс дрона
+    """
+    from astrobox.core import Drone
+
+    class Collector(Drone):
+        # стрелять только во время погрузки и разгрузки: разворот отменил бы движение,
+        # а повторный move_at к той же цели движок пропускает
+        is_transferring = False
+
+        def on_born(self):
+            self.move_at(random.choice(self.asteroids))
+
+        def on_stop_at_asteroid(self, asteroid):
+            self.is_transferring = True
+            self.load_from(asteroid)
+
+        def on_load_complete(self):
+            self.is_transferring = False
+            self.move_at(self.my_mothership)
+
+        def on_stop_at_mothership(self, mothership):
+            self.is_transferring = True
+            self.unload_to(mothership)
+
+        def on_unload_complete(self):
+            self.is_transferring = False
+            self.move_at(random.choice(self.asteroids))
+
+        def on_heartbeat(self):
+            if not self.is_transferring:
+                return
+            enemies = [drone for drone in self.scene.drones if drone.team != self.team and drone.is_alive]
+            if enemies and random.random() < 0.3:
+                enemy = min(enemies, key=lambda drone: self.distance_to(drone))
+                self.turn_to(enemy)
+                self.gun.shot(enemy)
+
+    class Idle(Drone):
+        pass
+
+    opponents = {"collector": Collector, "idle": Idle}
+    if name not in opponents:
+        raise ValueError("неизвестный соперник {}, есть: {}".format(name, ", ".join(opponents)))
+    return opponents[name]
+
+
+def load_drone_class(spec):
+    """
+    Загрузить класс дрона
+
+    :param spec: имя встроенного соперника, "модуль" (берется drone_class модуля) или "модуль:Класс"
+    :return: класс дрона
+    """
+    if ":" in spec:
+        module_name, class_name = spec.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)
+    try:
+        return builtin_opponent(spec)
+    except ValueError:
+        return importlib.import_module(spec).drone_class
+
+
+def play(match):
+    """
+    Сыграть один матч, вызывается в отдельном процессе
+
+    :param match: параметры матча (dict)
+    :return: результат матча (dict)
+    """
+    random.seed(match["seed"])
+    from astrobox.space_field import SpaceField
+    import trifonov_a_s
+
+    drone_class = trifonov_a_s.drone_class
+    heartbeats = []
+    on_heartbeat = drone_class.on_heartbeat
+
+    def timed_on_heartbeat(self):
+        begin = time.perf_counter()
+        on_heartbeat(self)
+        heartbeats.append(time.perf_counter() - begin)
+
+    drone_class.on_heartbeat = timed_on_heartbeat
+    if match.get("place_search"):
+        trifonov_a_s.Combat.place_search = match["place_search"]
+    if match.get("profile"):
+        trifonov_a_s.Profiler.enable()
+    if match.get("trace"):
+        trifonov_a_s.TraceRecorder.enable(os.path.join(match["trace"], "seed{}.trace".format(match["seed"])))
+
+    opponents = [load_drone_class(spec) for spec in match["opponents"]]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        scene = SpaceField(field=(1200, 600), speed=5, asteroids_count=match["asteroids"],
+                           headless=True, can_fight=True)
+        teams = [[drone_class() for _ in range(match["drones"])]]
+        teams += [[opponent() for _ in range(match["drones"])] for opponent in opponents]
+        if match.get("memory"):
+            tracemalloc.start()
+        collections = [generation["collections"] for generation in gc.get_stats()]
+        begin = time.perf_counter()
+        result = scene.go()
+        wall_time = time.perf_counter() - begin
+        collections = [generation["collections"] - count for generation, count in zip(gc.get_stats(), collections)]
+        memory_peak = 0
+        if match.get("memory"):
+            memory_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    if match.get("trace"):
+        trifonov_a_s.TraceRecorder.disable()
+    if match.get("profile"):
+        path = os.path.join(match["profile"], "seed{}".format(match["seed"]))
+        trifonov_a_s.Profiler.dump(path, "summary")
+        trifonov_a_s.Profiler.dump(path, "folded")
+
+    collected = {str(team): value for team, value in result.get("collected", {}).items()}
+    dead = {str(team): value for team, value in result.get("dead", {}).items()}
+    team = str(teams[0][0].team)
+    others = [value for name, value in collected.items() if name != team]
+    return {
+        "seed": match["seed"],
+        "opponents": match["opponents"],
+        "team": team,
+        "collected": collected,
+        "dead": dead,
+        "win": bool(collected) and all(collected.get(team, 0) > value for value in others),
+        "steps": scene._step,
+        "wall_time": wall_time,
+        "ticks_per_second": scene._step / wall_time if wall_time else 0.0,
+        "heartbeats": len(heartbeats),
+        "heartbeat_mean_ms": statistics.mean(heartbeats) * 1000 if heartbeats else 0.0,
+        "heartbeat_max_ms": max(heartbeats) * 1000 if heartbeats else 0.0,
+        "gc_collections": collections,
+        "memory_peak_mb": memory_peak / 2 ** 20,
+        "step_cache": {name: list(stats) for name, stats in trifonov_a_s.StepCache.stats.items()},
+    }
+
+
+def parse_seeds(text):
+    """
+    Разобрать список сидов: "1,2,5" или "1-8" или "1-4,10"
+    """
+    seeds = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            seeds.extend(range(int(first), int(last) + 1))
+        elif part:
+            seeds.append(int(part))
+    return seeds
+
+
+def run(seeds, opponents, drones=5, asteroids=15, processes=None, profile=None, memory=False, trace=None,
+        place_search=None):
+    """
+    Сыграть матчи параллельно
+
+    :param seeds: сиды матчей
+    :param opponents: соперники, каждый - команда в каждом матче
+    :param processes: число процессов, по умолчанию по числу ядер
+    :param profile: каталог для результатов профилирования (Profiler), None - без профилирования
+    :param memory: замерять пик памяти (tracemalloc)
+    :param trace: каталог для записей решений (TraceRecorder), None - без записи
+    :param place_search: режим поиска места атаки (Combat.place_search), None - по умолчанию
+    :return: результаты матчей в порядке сидов
+    """
+    for directory in (profile, trace):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    matches = [{"seed": seed, "opponents": list(opponents), "drones": drones, "asteroids": asteroids,
+                "profile": profile, "memory": memory, "trace": trace, "place_search": place_search} for seed in seeds]
+    # новый процесс на каждый матч: сцена движка живет в атрибутах классов
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=processes, maxtasksperchild=1) as pool:
+        return pool.map(play, matches, chunksize=1)
+
+
+def summary(results):
+    """
+    Сводка по матчам
+    """
+    return {
+        "matches": len(results),
+        "win_rate": sum(result["win"] for result in results) / len(results),
+        "elerium_mean": statistics.mean(result["collected"].get(result["team"], 0) for result in results),
+        "steps_mean": statistics.mean(result["steps"] for result in results),
+        "ticks_per_second_mean": statistics.mean(result["ticks_per_second"] for result in results),
+        "heartbeat_mean_ms": statistics.mean(result["heartbeat_mean_ms"] for result in results),
+        "heartbeat_max_ms": max(result["heartbeat_max_ms"] for result in results),
+        "gc_collections_mean": [statistics.mean(counts) for counts in zip(*(result["gc_collections"]
+                                                                         for result in results))],
+        "memory_peak_mb": max(result["memory_peak_mb"] for result in results),
+        "wall_time_total": sum(result["wall_time"] for result in results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Матчи без интерфейса и замер производительности")
+    parser.add_argument("--seeds", default="1-4", help="сиды: 1,2,5 или 1-8")
+    parser.add_argument("--opponent", action="append", dest="opponents",
+                        help="соперник: collector, idle, модуль или модуль:Класс; можно несколько")
+    parser.add_argument("--drones", type=int, default=5, help="дронов в команде")
+    parser.add_argument("--asteroids", type=int, default=15, help="астероидов")
+    parser.add_argument("--processes", type=int, default=None, help="процессов, по умолчанию по числу ядер")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--profile", help="каталог для таблиц и свернутых стеков профилировщика")
+    parser.add_argument("--memory", action="store_true", help="замерять пик памяти (медленнее)")
+    parser.add_argument("--trace", help="каталог для записей решений, по записи на матч")
+    parser.add_argument("--place-search", choices=["grid", "vector"], help="режим поиска места атаки бойцов")
+    args = parser.parse_args(argv)
+
+    results = run(parse_seeds(args.seeds), args.opponents or ["collector"], drones=args.drones,
+                  asteroids=args.asteroids, processes=args.processes, profile=args.profile, memory=args.memory,
+                  trace=args.trace, place_search=args.place_search)
+    for result in results:
+        print("seed {seed:>4} {outcome:>4} steps {steps:>6} elerium {elerium:>5} "
+              "ticks/s {ticks_per_second:8.1f} heartbeat {heartbeat_mean_ms:6.2f} ms "
+              "(max {heartbeat_max_ms:7.2f}) gc {gc} memory {memory_peak_mb:.1f} MB".format(
+                  outcome="win" if result["win"] else "loss", elerium=result["collected"].get(result["team"], 0),
+                  gc="/".join(str(count) for count in result["gc_collections"]), **result))
+    total = summary(results)
+    print("win rate {win_rate:.2f}, elerium {elerium_mean:.1f}, ticks/s {ticks_per_second_mean:.1f}, "
+          "heartbeat {heartbeat_mean_ms:.2f} ms (max {heartbeat_max_ms:.2f}), "
+          "gc {gc}, memory {memory_peak_mb:.1f} MB, wall time {wall_time_total:.1f} s".format(
+              gc="/".join("{:.0f}".format(count) for count in total["gc_collections_mean"]), **total))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"summary": total, "matches": results}, file, indent=2)
+    return total
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""
+Микробенчмарки горячих точек стратегии на синтетических сценах.
+
+Сцена строится без интерфейса и без игрового цикла: headless SpaceField только хранит объекты, дроны, астероиды,
+материнские корабли и снаряды в полете расставляются случайно (сид постоянный), события рождения обрабатываются
+один раз, дальше замеряются отдельные методы. Стратегия проверяет типы объектов через isinstance, поэтому
+используются объекты движка, а не самодельные заглушки.
+
+Время каждого замера делится на время эталонного цикла на чистом Python, так результаты разных машин
+сопоставимы. Результаты сравниваются с сохраненными в microbench_baseline.json: если замер медленнее более чем
+на --tolerance или рост времени от размера сцены (наклон в логарифмических осях) круче более чем на
+--slope-tolerance, выход с кодом 1.
+
+Перед замерами геометрия на числах (vector_between, direction_of, ...) сверяется с типами движка
+(Point, Vector) на случайных и граничных точках, а векторизованный расчет выстрелов first_hits -
+с TrifonovDrone.result_shot; расхождение - тоже выход с кодом 1.
+
+Пример:
+    python microbench.py                 # сравнить с базой
+    python microbench.py --update        # записать базу
+    python microbench.py --only Radar.reflect --sizes small,large
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbench_baseline.json")
+# размеры сцен: дронов в команде, астероидов, снарядов в полете
+SIZES = {
+    "small": (5, 10, 5),
+    "medium": (20, 40, 20),
+    "large": (60, 120, 60),
+    "huge": (100, 200, 100),
+}
+
+
+def calibrate():
+    """
+    Время эталонного цикла на чистом Python, секунд
+    """
+    best = None
+    for _ in range(5):
+        begin = time.perf_counter()
+        total = 0.0
+        for i in range(200000):
+            total += math.sqrt(i) * 0.5
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(function, repeat=5, min_time=0.05):
+    """
+    Время одного вызова: вызовы повторяются, пока серия не займет min_time, берется лучшая из repeat серий.
+    Как и в timeit, сборщик мусора на время замера выключен.
+
+    :return: секунд на вызов
+    """
+    is_gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _measure(function, repeat, min_time)
+    finally:
+        if is_gc_enabled:
+            gc.enable()
+
+
+def _measure(function, repeat, min_time):
+    number = 1
+    while True:
+        begin = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - begin
+        if elapsed >= min_time or number >= 1 << 16:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        begin = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - begin) / number)
+    return best
+
+
+class SyntheticScene:
+    """
+        Синтетическая сцена: свои дроны (TrifonovDrone) против неподвижных дронов соперника,
+        снаряды соперника летят в своих дронов.
+    """
+
+    def __init__(self, drones, asteroids, projectiles, seed=1):
+        from astrobox.core import Drone
+        from astrobox.guns import PlasmaProjectile
+        from astrobox.space_field import SpaceField
+        from robogame_engine.geometry import Point, Vector
+        from robogame_engine.theme import theme
+        import trifonov_a_s
+
+        class BenchEnemy(Drone):
+            pass
+
+        random.seed(seed)
+        self.size = (drones, asteroids, projectiles)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.scene = SpaceField(field=(1200, 600), speed=5, headless=True, can_fight=True)
+            self.own = [trifonov_a_s.TrifonovDrone() for _ in range(drones)]
+            self.enemies = [BenchEnemy() for _ in range(drones)]
+            self.scene.prepare(asteroids_count=asteroids, max_drones_at_team=drones)
+
+        margin = Drone.radius
+        for drone in self.own + self.enemies:
+            drone.coord = Point(random.uniform(margin, theme.FIELD_WIDTH - margin),
+                                random.uniform(margin, theme.FIELD_HEIGHT - margin))
+            drone.vector = Vector.from_direction(random.randint(0, 359), module=1)
+        for number in range(projectiles):
+            owner = self.enemies[number % len(self.enemies)]
+            if number < len(self.enemies):
+                target = random.choice(self.own)
+                owner.vector = Vector.from_points(owner.coord, target.coord, module=1)
+            offset = Vector.from_direction(owner.direction,
+                                           module=random.uniform(0, PlasmaProjectile.max_distance / 2))
+            projectile = PlasmaProjectile(coord=owner.coord.copy() + offset, owner=owner, direction=owner.direction)
+            projectile.set_team(owner.team)
+        # рождение: свои дроны получают голову и роли, снаряды начинают полет
+        for obj in list(self.scene.objects):
+            obj.proceed_events()
+        self.head = self.own[0].head
+
+    def set_role(self, role):
+        """
+        Назначить всем своим дронам роль
+
+        :return: список ролей
+        """
+        for drone in self.own:
+            drone.role = role
+        return [drone.role for drone in self.own]
+
+
+def bench_result_shot(synthetic):
+    objects = [obj for obj in synthetic.scene.objects if obj.__class__.__name__ != "PlasmaProjectile"]
+    shots = [(drone, random.choice(synthetic.enemies)) for drone in synthetic.own]
+
+    def run():
+        for drone, target in shots:
+            drone.result_shot(drone, drone.coord, target.coord, objects)
+    return run
+
+
+def bench_reflect(synthetic):
+    radar = synthetic.head.radar
+
+    def run():
+        radar._tick = None
+        radar._predictions = {}
+        radar.reflect()
+    return run
+
+
+def bench_health(synthetic):
+    radar = synthetic.head.radar
+    radar._tick = None
+    radar.reflect()
+    drones = synthetic.own + synthetic.enemies
+
+    def run():
+        radar._health = {}
+        for drone in drones:
+            radar.health(drone)
+    return run
+
+
+def bench_get_source_elerium(synthetic):
+    import trifonov_a_s
+    routers = [role.router for role in synthetic.set_role(trifonov_a_s.Collector)]
+
+    def run():
+        for router in routers:
+            router._refresh()
+            router._get_source_elerium(router._drone.free_space)
+    return run
+
+
+def bench_level_danger(synthetic):
+    import trifonov_a_s
+    router = synthetic.set_role(trifonov_a_s.Collector)[0].router
+    sources = synthetic.head.world.sources
+
+    def run():
+        synthetic.head.threats._tick = None
+        for source in sources:
+            router.level_danger(source)
+    return run
+
+
+def bench_get_place(synthetic):
+    import trifonov_a_s
+    fighters = synthetic.set_role(trifonov_a_s.Combat)
+    targets = [fighter.get_target() for fighter in fighters]
+    head = synthetic.head
+
+    def run():
+        head.places_attacks = {}
+        head.occlusion = None
+        for fighter, target in zip(fighters, targets):
+            fighter._target = None
+            if target is not None:
+                fighter.get_place(target)
+    return run
+
+
+def bench_init_place(synthetic):
+    import trifonov_a_s
+    defender = synthetic.set_role(trifonov_a_s.Defender)[0]
+    head = synthetic.head
+
+    def run():
+        head.positions = []
+        defender._init_place()
+    return run
+
+
+def geometry_points(count, seed=1):
+    """
+    Пары точек для сверки геометрии: случайные, совпадающие, на одной вертикали и горизонтали, целые
+    """
+    rng = random.Random(seed)
+    pairs = [((0, 0), (0, 0)), ((10, 10), (10, 50)), ((10, 50), (10, 10)), ((10, 10), (50, 10)),
+             ((50, 10), (10, 10)), ((0.5, 0.5), (0.5, 0.5))]
+    for _ in range(count):
+        a = (rng.uniform(0, 1200), rng.uniform(0, 600))
+        b = (rng.uniform(0, 1200), rng.uniform(0, 600))
+        if rng.random() < 0.25:
+            a, b = (round(a[0]), round(a[1])), (round(b[0]), round(b[1]))
+        pairs.append((a, b))
+    return pairs
+
+
+def check_geometry(count=20000):
+    """
+    Сверить геометрию на числах с типами движка
+
+    :return: список расхождений (текст)
+    """
+    import numpy as np
+    from robogame_engine.geometry import Point, Vector
+    import trifonov_a_s as strategy
+
+    mismatches = []
+    pairs = geometry_points(count)
+    for (x_1, y_1), (x_2, y_2) in pairs:
+        point_1, point_2 = Point(x_1, y_1), Point(x_2, y_2)
+        for module in (None, 1, strategy.TrifonovDrone.SPEED, 3.7):
+            vector = Vector.from_points(point_1, point_2, module=module)
+            vector_x, vector_y = strategy.vector_between(x_1, y_1, x_2, y_2, module)
+            actual = (vector_x, vector_y, strategy.module_of(vector_x, vector_y),
+                      strategy.direction_of(vector_x, vector_y))
+            expected = (vector.x, vector.y, vector.module, vector.direction)
+            if actual != expected:
+                mismatches.append("vector {} -> {} module {}: {} != {}".format(point_1, point_2, module,
+                                                                             actual, expected))
+        if strategy.distance_between(x_1, y_1, x_2, y_2) != point_1.distance_to(point_2):
+            mismatches.append("distance {} -> {}".format(point_1, point_2))
+
+    # пакетные варианты против скалярных
+    vectors = [strategy.vector_between(x_1, y_1, x_2, y_2, strategy.TrifonovDrone.SPEED)
+               for (x_1, y_1), (x_2, y_2) in pairs]
+    xs = np.array([vector[0] for vector in vectors])
+    ys = np.array([vector[1] for vector in vectors])
+    directions = strategy.directions_of(xs, ys)
+    headings = [random.Random(index).uniform(0, 360) for index in range(len(pairs))]
+    for index, (x, y) in enumerate(vectors):
+        direction = strategy.direction_of(x, y)
+        if directions[index] != direction:
+            mismatches.append("directions_of ({}, {}): {} != {}".format(x, y, directions[index], direction))
+        angle = strategy.turn_angle(direction, headings[index])
+        if strategy.turn_angles(direction, headings[index]) != angle:
+            mismatches.append("turn_angles {} {}".format(direction, headings[index]))
+    return mismatches
+
+
+def check_first_hits(count=10000, seed=1):
+    """
+    Сверить first_hits с TrifonovDrone.result_shot на случайных выстрелах в синтетических сценах:
+    места стрельбы случайные, в центрах объектов и совпадающие с целью
+
+    :return: список расхождений (текст)
+    """
+    from robogame_engine.geometry import Point
+    import trifonov_a_s as strategy
+
+    mismatches = []
+    rng = random.Random(seed)
+    shots_per_scene = 500
+    for number in range(count // shots_per_scene):
+        synthetic = SyntheticScene(*SIZES["small"], seed=seed + number)
+        objects = [obj for obj in synthetic.scene.objects if obj.__class__.__name__ != "PlasmaProjectile"]
+        centers, radii, ids = strategy.objects_arrays(objects)
+        shots = []
+        for _ in range(shots_per_scene):
+            drone = rng.choice(synthetic.own)
+            kind = rng.random()
+            if kind < 0.4:
+                place = Point(rng.uniform(0, 1200), rng.uniform(0, 600))
+            elif kind < 0.9:
+                place = rng.choice(objects).coord.copy()
+            else:
+                place = None
+            target = rng.choice(objects).coord.copy()
+            shots.append((drone, place or target.copy(), target))
+        indexes = strategy.first_hits(places=[(place.x, place.y) for _, place, _ in shots],
+                                      targets=[(target.x, target.y) for _, _, target in shots],
+                                      shooter_ids=[drone.id for drone, _, _ in shots],
+                                      radius_projectile=[drone.gun.projectile.radius for drone, _, _ in shots],
+                                      centers=centers, radii=radii, ids=ids)
+        for (drone, place, target), index in zip(shots, indexes):
+            expected = strategy.TrifonovDrone.result_shot(drone, place, target, objects)
+            actual = objects[index] if index >= 0 else None
+            if actual is not expected:
+                mismatches.append("first_hits {} -> {}: {} != {}".format(place, target, actual, expected))
+    return mismatches
+
+
+BENCHMARKS = {
+    "TrifonovDrone.result_shot": bench_result_shot,
+    "Radar.reflect": bench_reflect,
+    "Radar.health": bench_health,
+    "Router._get_source_elerium": bench_get_source_elerium,
+    "Router.level_danger": bench_level_danger,
+    "Combat.get_place": bench_get_place,
+    "Defender._init_place": bench_init_place,
+}
+
+
+def scale(size):
+    """
+    Размер сцены одним числом: всего объектов
+    """
+    drones, asteroids, projectiles = SIZES[size]
+    return drones * 2 + asteroids + projectiles
+
+
+def slope(times, sizes):
+    """
+    Наклон роста времени от размера сцены в логарифмических осях между крайними размерами
+    """
+    first, last = sizes[0], sizes[-1]
+    if first == last or not times.get(first) or not times.get(last):
+        return None
+    return math.log(times[last] / times[first]) / math.log(scale(last) / scale(first))
+
+
+def run(names=None, sizes=None):
+    """
+    Выполнить замеры
+
+    :param names: замеры, по умолчанию все
+    :param sizes: размеры сцен, по умолчанию все
+    :return: {"calibration": лучшее время эталона, секунд,
+              "times": {замер: {размер: время / calibration}},
+              "slopes": {замер: наклон}}
+    """
+    names = names or list(BENCHMARKS)
+    sizes = sizes or list(SIZES)
+    calibrations = []
+    times = {name: {} for name in names}
+    for size in sizes:
+        for name in names:
+            # новая сцена на каждый замер: замеры меняют роли дронов
+            synthetic = SyntheticScene(*SIZES[size])
+            elapsed = measure(BENCHMARKS[name](synthetic))
+            # эталон замеряется рядом с каждым замером: скорость машины могла измениться
+            calibrations.append(calibrate())
+            times[name][size] = elapsed / calibrations[-1]
+    return {
+        "calibration": min(calibrations),
+        "times": times,
+        "slopes": {name: slope(times[name], sizes) for name in names},
+    }
+
+
+def compare(result, baseline, tolerance=1.0, slope_tolerance=0.25):
+    """
+    Сравнить с базой
+
+    :param tolerance: допустимое замедление, доля
+    :param slope_tolerance: допустимый рост наклона
+    :return: список регрессий (текст)
+    """
+    regressions = []
+    for name, times in result["times"].items():
+        for size, value in times.items():
+            base = baseline["times"].get(name, {}).get(size)
+            if base and value > base * (1 + tolerance):
+                regressions.append("{} {}: {:.2f} против {:.2f} в базе".format(name, size, value, base))
+        value, base = result["slopes"].get(name), baseline["slopes"].get(name)
+        if value is not None and base is not None and value > base + slope_tolerance:
+            regressions.append("{} наклон: {:.2f} против {:.2f} в базе".format(name, value, base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих точек на синтетических сценах")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="замер, можно несколько")
+    parser.add_argument("--sizes", help="размеры сцен через запятую: " + ",".join(SIZES))
+    parser.add_argument("--baseline", default=BASELINE, help="файл базы")
+    parser.add_argument("--update", action="store_true", help="записать результаты как базу")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="допустимое замедление, доля (1.0 - вдвое)")
+    parser.add_argument("--slope-tolerance", type=float, default=0.25, help="допустимый рост наклона")
+    args = parser.parse_args(argv)
+
+    mismatches = check_geometry() + check_first_hits()
+    for mismatch in mismatches[:20]:
+        print("расхождение: " + mismatch)
+    if mismatches:
+        return 1
+
+    sizes = args.sizes.split(",") if args.sizes else None
+    result = run(args.only, sizes)
+    print("{:<28} {}  {:>6}".format("benchmark", " ".join("{:>9}".format(size) for size in sizes or SIZES), "slope"))
+    for name, times in result["times"].items():
+        slope_value = result["slopes"][name]
+        print("{:<28} {}  {:>6}".format(name, " ".join("{:>9.3f}".format(times[size]) for size in times),
+                                        "{:.2f}".format(slope_value) if slope_value is not None else "-"))
+    print("calibration {:.1f} ms, times in calibration units".format(result["calibration"] * 1000))
+
+    if args.update:
+        with open(args.baseline, "w") as file:
+            json.dump(result, file, indent=2)
+        return 0
+    if not os.path.exists(args.baseline):
+        print("нет базы {}, запустите с --update".format(args.baseline))
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(result, baseline, args.tolerance, args.slope_tolerance)
+    for regression in regressions:
+        print("регрессия: " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,26 +3,98 @@ from __future__ import annotations
 from astrobox.core import Drone, Asteroid, MotherShip, GameObject
 from robogame_engine.theme import theme
 from robogame_engine.geometry import Vector, Point
-from math import ceil, floor
+from math import ceil, floor, sqrt, atan, pi, isnan
+from time import perf_counter
+from functools import wraps
+from weakref import WeakKeyDictionary
+from queue import Queue
+from threading import Thread
+import struct
+import numpy as np
 from robogame_engine.states import StateMoving, StateTurning, StateStopped
 from astrobox.space_field import Scene
 from astrobox.guns import PlasmaProjectile
 
 
+class StepCache:
+    """
+        Класс КэшХода.
+        Декоратор методов дрона: результат запоминается до смены хода (head.step()).
+        Дроны двигаются и между тактами соседей, поэтому запомненное действительно, только пока дрон
+        не сдвинулся и не повернулся - положение и направление входят в ключ.
+        Размер кэша метода у дрона ограничен, при переполнении забываются самые старые значения.
+        Точки в аргументах сравниваются по координатам.
+    """
+    # {метод: [попаданий, промахов]}
+    stats = {}
+
+    def __init__(self, maxsize=64):
+        """
+        :param maxsize: сколько значений метода хранить у одного дрона
+        """
+        self.maxsize = maxsize
+
+    def __call__(self, method):
+        name = method.__qualname__
+        stats = StepCache.stats.setdefault(name, [0, 0])
+        maxsize = self.maxsize
+
+        @wraps(method)
+        def wrapper(drone, *args, **kwargs):
+            state = (drone.head.step() if drone.head is not None else None,
+                     drone.coord.x, drone.coord.y, drone.vector.x, drone.vector.y)
+            cache = drone.step_cache.get(name)
+            if cache is None or cache[0] != state:
+                cache = drone.step_cache[name] = (state, {})
+            values = cache[1]
+            key = tuple((arg.x, arg.y) if isinstance(arg, Point) else arg for arg in args)
+            if kwargs:
+                key += tuple(sorted((kw, (arg.x, arg.y) if isinstance(arg, Point) else arg)
+                                    for kw, arg in kwargs.items()))
+            if key in values:
+                stats[0] += 1
+                return values[key]
+            stats[1] += 1
+            if len(values) >= maxsize:
+                del values[next(iter(values))]
+            value = values[key] = method(drone, *args, **kwargs)
+            return value
+        return wrapper
+
+    @staticmethod
+    def reset():
+        """
+        Сбросить счетчики
+        """
+        for stats in StepCache.stats.values():
+            stats[0] = stats[1] = 0
+
+    @staticmethod
+    def summary():
+        """
+        Таблица: метод, попаданий, промахов, доля попаданий
+
+        :return: текст
+        """
+        lines = ["{:<36} {:>10} {:>10} {:>6}".format("method", "hits", "misses", "rate")]
+        for name, (hits, misses) in sorted(StepCache.stats.items()):
+            rate = hits / (hits + misses) if hits + misses else 0.0
+            lines.append("{:<36} {:>10} {:>10} {:>6.2f}".format(name, hits, misses, rate))
+        return "\n".join(lines) + "\n"
+
+
 class TrifonovDrone(Drone):
     SPEED = theme.DRONE_SPEED
     TURN_SPEED = theme.DRONE_TURN_SPEED
     MAX_PAYLOAD = theme.MAX_DRONE_ELERIUM
     MAX_HEALTH = theme.DRONE_MAX_SHIELD
 
-    count_drone = 0
-    _step = 0
-
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.head = None
         self._role = None
-        TrifonovDrone.count_drone += 1
+        # {метод: (ход и положение дрона, {аргументы: значение})} для StepCache
+        self.step_cache = {}
 
     @property
     def role(self):
@@ -65,15 +137,17 @@ class TrifonovDrone(Drone):
             self.role.on_stop_at_mothership(mothership)
 
     def on_load_complete(self):
+        self.head.world.invalidate()
         if self._role:
             self.role.on_load_complete()
 
     def on_unload_complete(self):
+        self.head.world.invalidate()
         if self._role:
             self.role.on_unload_complete()
 
     def on_heartbeat(self):
-        TrifonovDrone._step += 1
+        self.head.count_heartbeats += 1
         self.head.on_heartbeat(self)
         if self._role:
             self.role.on_heartbeat()
@@ -110,28 +184,29 @@ class TrifonovDrone(Drone):
         """
         return self._transition is not None and self._transition.cargo_from == self._cargo
 
+    @StepCache()
     def steps_to(self, point: Point):
         """
             Растояние до точки в шагах (step)
         """
-        vector = Vector.from_points(self.coord, point, module=self.SPEED)
-        if not vector.module:
+        x, y = self.coord.x, self.coord.y
+        vector_x, vector_y = vector_between(x, y, point.x, point.y, self.SPEED)
+        module = module_of(vector_x, vector_y)
+        if not module:
             return 0
-        distance = self.coord.distance_to(point)
-        count_steps = ceil(distance / vector.module)
-        count_steps += self.steps_to_turn(point)
+        count_steps = ceil(distance_between(x, y, point.x, point.y) / module)
+        count_steps += ceil(turn_angle(direction_of(vector_x, vector_y), self.direction) / self.TURN_SPEED)
         return count_steps
 
+    @StepCache()
     def steps_to_turn(self, point: Point):
         """
             Шагов (step) для разварота на точку
         """
-        vector = Vector.from_points(self.coord, point, module=self.SPEED)
-        if not vector.module:
+        vector_x, vector_y = vector_between(self.coord.x, self.coord.y, point.x, point.y, self.SPEED)
+        if not module_of(vector_x, vector_y):
             return 0
-        delta = abs(vector.direction - self.direction)
-        delta = delta if delta <= 180 else 360 - delta
-        return ceil(delta / self.TURN_SPEED)
+        return ceil(turn_angle(direction_of(vector_x, vector_y), self.direction) / self.TURN_SPEED)
 
     @property
     def move_target(self):
@@ -156,15 +231,6 @@ class TrifonovDrone(Drone):
         """
         return self.defeat_distance(target) >= self.coord.distance_to(target.coord)
 
-    @classmethod
-    def step(cls):
-        """
-        Получить текущий ход
-
-        :return: текущий ход
-        """
-        return cls._step // cls.count_drone * theme.HEARTBEAT_INTERVAL
-
     def shot(self, target):
         """
         Стрелять в цель
@@ -174,21 +240,34 @@ class TrifonovDrone(Drone):
 
         if target is None:
             return
-        vector = Vector.from_points(self.coord, target.coord, module=self.SPEED)
-        delta = abs(vector.direction - self.direction)
+        vector_x, vector_y = vector_between(self.coord.x, self.coord.y, target.coord.x, target.coord.y, self.SPEED)
+        delta = abs(direction_of(vector_x, vector_y) - self.direction)
         if delta > 1:
             self.turn_to(target)
         else:
             if self.can_shot(target):
                 self.gun.shot(target)
 
+    def objects_at_line_of_fire(self, point: Point):
+        """
+        Объекты, которые могут оказаться на линии огня (для расчета result_shot)
+
+        :param point: точка прицеливания
+        :return: список объектов
+        """
+        # result_shot отсекает объекты по габаритам линии огня, поэтому центр пораженного объекта
+        # может отстоять от отрезка дальше суммы радиусов, но не больше чем на удвоенную сумму
+        width = 2 * self.gun.projectile.radius + self.head.grid.max_radius
+        objects = self.head.grid.along_segment(self.coord, point, width)
+        return [obj for obj in objects if hasattr(obj, "damage_taken") and obj.is_alive]
+
     def can_shot(self, target):
         """
         Могу стрелять по цели? (проверка огня по своим)
 
         :param target: цель
         """
-        objects = [obj for obj in self.scene.objects if hasattr(obj, "damage_taken") and obj.is_alive]
+        objects = self.objects_at_line_of_fire(target.coord)
         hit_obj = self.result_shot(self, self.coord, target.coord, objects)
         return hit_obj.team != self.team
 
@@ -205,7 +284,7 @@ class TrifonovDrone(Drone):
         """
         # раудиус снаряда
         radius_projectile = drone.gun.projectile.radius
-        vector = Vector.from_points(place, target, radius_projectile)
+        vector_x, vector_y = vector_between(place.x, place.y, target.x, target.y, radius_projectile)
         x_min = min(place.x, target.x) - radius_projectile
         x_max = max(place.x, target.x) + radius_projectile
         y_min = min(place.y, target.y) - radius_projectile
@@ -218,21 +297,20 @@ class TrifonovDrone(Drone):
                     or y_min > obj.coord.y + obj.radius or y_max < obj.coord.y - obj.radius):
                 continue
             # проэкция на линию огня
-            if vector.x != 0 or vector.y != 0:
+            if vector_x != 0 or vector_y != 0:
                 delta_x = obj.coord.x - place.x
                 delta_y = obj.coord.y - place.y
-                t = vector.x * delta_x + vector.y * delta_y
-                t = t / (vector.x ** 2 + vector.y ** 2)
-                p_x = vector.x * t + place.x
-                p_y = vector.y * t + place.y
-                p_coord = Point(p_x, p_y)
+                t = vector_x * delta_x + vector_y * delta_y
+                t = t / (vector_x ** 2 + vector_y ** 2)
+                p_x = vector_x * t + place.x
+                p_y = vector_y * t + place.y
             else:
-                p_coord = place
+                p_x, p_y = place.x, place.y
 
             summa_radius = obj.radius + radius_projectile
-            if abs(obj.coord.x - p_coord.x) > summa_radius and abs(obj.coord.y - p_coord.y) > summa_radius:
+            if abs(obj.coord.x - p_x) > summa_radius and abs(obj.coord.y - p_y) > summa_radius:
                 continue
-            distance = p_coord.distance_to(obj.coord)
+            distance = distance_between(p_x, p_y, obj.coord.x, obj.coord.y)
             overlap_distance = int(summa_radius - distance)
             if overlap_distance > 1:
                 hit_obj.append(obj)
@@ -247,7 +325,7 @@ class TrifonovDrone(Drone):
         """
         if not self.at_shot_distance(target):
             return False
-        objects = [obj for obj in self.scene.objects if hasattr(obj, "damage_taken") and obj.is_alive]
+        objects = self.objects_at_line_of_fire(target.coord)
         hit_obj = self.result_shot(self, self.coord, target.coord, objects)
         return hit_obj.id == target.id
 
@@ -256,7 +334,9 @@ class SourceElerium:
     """
         Класс ИсточникЭлериума
         используется при нахождении маршрутов.
+        Создается десятками за такт, поэтому без __dict__.
     """
+    __slots__ = ("_payload", "_parent")
 
     def __init__(self, asteroid, payload=None):
         if payload is None:
@@ -287,398 +367,1345 @@ class SourceElerium:
         return self.__class__(asteroid=self._parent, payload=self.payload)
 
 
-class CounterStep:
+class WorldSnapshot:
     """
-        Класс СчетчикХода.
-        Имеет один метод для проверки нового хода
+        Класс СнимокМира.
+        Список источников элериума, общий для всех дронов команды.
+        Строится один раз за ход, либо после явного сброса (завершение погрузки/разгрузки).
+        Источники, чей остаток не изменился, переходят в новый снимок из прежнего, а не создаются заново.
     """
-    __step = 0
 
-    @classmethod
-    def _is_new_step(cls):
+    def __init__(self, head: Head):
+        self._head = head
+        self._scene = head.scene
+        self._step = None
+        self._sources = []
+        self._payload = 0
+        # номер снимка, растет при каждом построении
+        self._version = 0
+        # источники прежнего снимка {id объекта: SourceElerium}
+        self._pool = {}
+
+    def invalidate(self):
         """
-        Наступил новый ход
+        Сбросить снимок, при следующем обращении он будет построен заново
         """
-        result = cls.__step != TrifonovDrone.step()
-        if result:
-            cls.__step = TrifonovDrone.step()
-        return result
+        self._step = None
 
+    def _refresh(self):
+        """
+        Построить снимок, если наступил новый ход или снимок сброшен
+        """
+        step = self._head.step()
+        if self._step == step:
+            return
+        self._step = step
+        self._version += 1
+        pool = {}
+        # астероид, опустевший к построению массивов, источником уже не станет
+        arrays = self._head.arrays
+        candidates = arrays.mask(kinds=(WorldArrays.DRONE, WorldArrays.MOTHERSHIP)) | arrays.mask(has_payload=True)
+        for obj in arrays.select(candidates):
+            if not Router.is_source_elerium(obj):
+                continue
+            source = self._pool.get(obj.id)
+            if source is None or source.parent is not obj or source.payload != obj.payload:
+                source = SourceElerium(obj)
+            pool[obj.id] = source
+        self._pool = pool
+        self._sources = list(pool.values())
+        self._payload = sum(source.payload for source in self._sources)
 
-class Head(CounterStep):
-    """
-        Класс Голова.
-        Управляет дронами через назначение им ролей.
-        Содержит интерфейс для общих методов команды. В частности содержит ссылку экземпляр класса Radar.
-    """
-    __head = None
-    team = None
-    scene = None
-    all_elerium = 0
-    drones = []
-    teams = []
-    radar = None
-    #игровая статистика
-    count_enemy_drones = 0
-    health_matherships = 0
-    payload = 0
-    game_over_tics = 0
-    count_step = 0
+    @property
+    def sources(self):
+        """
+        Список источников элериума [SourceElerium, ...].
+        Список общий для всех, изменять его и его элементы нельзя.
+        """
+        self._refresh()
+        return self._sources
 
-    class Team:
+    @property
+    def payload(self):
         """
-            Класс команда, предназначен для оценки состояния протвиника
+        Общий остаток элериума в источниках
         """
+        self._refresh()
+        return self._payload
 
-        def __init__(self, scene, team):
-            self.scene = scene
-            self.team = team
-            ships = [ship for ship in self.scene.motherships if ship.team == self.team and ship.is_alive]
-            self.mothership = ships[0] if ships else None
+    @property
+    def version(self):
+        """
+        Номер снимка: меняется вместе со списком источников
+        """
+        self._refresh()
+        return self._version
 
-        @property
-        def is_alive(self):
-            """
-                Команда жива
-            """
-            return self.drones or self.mothership
 
-        @property
-        def drones(self):
-            """
-                Список дронов команды
-            """
-            return [drone for drone in self.scene.drones if drone.team == self.team and drone.is_alive]
+class SpatialGrid:
+    """
+        Класс ПространственнаяСетка.
+        Равномерная сетка по игровому полю для запросов вдоль отрезка и ближайшего объекта (кроме снарядов),
+        запросы по радиусу - в массивах мира (WorldArrays).
+        Строится один раз за ход. Запросы учитывают смещение объектов за ход и проверяют их текущие координаты,
+        результат возвращается в порядке scene.objects.
+    """
 
-    @classmethod
-    def get_head(cls, drone: TrifonovDrone):
-        cls.drones.append(drone)
-        if cls.__head is None:
-            cls.__head = Head(drone)
-        return cls.__head
+    def __init__(self, head: Head, cell_size=100):
+        self._head = head
+        self._scene = head.scene
+        self.cell_size = cell_size
+        self.columns = ceil(theme.FIELD_WIDTH / cell_size)
+        self.rows = ceil(theme.FIELD_HEIGHT / cell_size)
+        # на сколько может сместиться объект за ход после построения сетки
+        self.margin = ceil(theme.DRONE_SPEED * theme.HEARTBEAT_INTERVAL)
+        self._max_radius = 0
+        self._cells = {}
+        self._order = {}
+        self._step = None
 
-    def __init__(self, drone: TrifonovDrone):
+    def _refresh(self):
         """
-        Не использовать, для получения головы использовать функцию get_head
-        :param drone: дрон
+        Построить сетку, если наступил новый ход
         """
-        if drone not in Head.drones:
-            raise NameError("для получения головы использовать функцию Head.get_head")
-        Head.all_elerium = sum(asteroid.payload for asteroid in drone.asteroids)
-        Head.scene = drone.scene
-        Head.team = drone.team
-        Head.radar = Radar(drone.scene, drone.team)
-        Head.count_enemy_drones, Head.health_matherships = Head._refresh_teams()
-
-        Head.payload = Head.all_elerium
-        # нужно тиков что бы дрону пролететь экран по диагонали
-        screen_diagonal = (theme.FIELD_WIDTH ** 2 + theme.FIELD_HEIGHT ** 2) ** .5
-        Head._game_over_tics = int(screen_diagonal / theme.DRONE_SPEED / theme.HEARTBEAT_INTERVAL * 0.8)
+        step = self._head.step()
+        if self._step == step:
+            return
+        self._step = step
+        self._cells = {}
+        self._order = {}
+        self._max_radius = 0
+        for index, obj in enumerate(self._scene.objects):
+            if isinstance(obj, PlasmaProjectile):
+                continue
+            self._order[obj.id] = index
+            self._cells.setdefault(self._cell(obj.coord.x, obj.coord.y), []).append(obj)
+            self._max_radius = max(self._max_radius, obj.radius)
 
-    @staticmethod
-    def _refresh_teams():
+    @property
+    def max_radius(self):
         """
-            Обновление данных о коммандах соперника в Head.team
-        :return: общее число дронов соперника, общее здоровье материнских короблей противника
+        Наибольший радиус объекта в сетке
         """
-        count_enemy_drones = 0
-        health_matherships = 0
-        Head.teams.clear()
-        for team in Head.scene.teams:
-            if team == Head.team:
-                continue
-            new_team = Head.Team(Head.scene, team)
-            if new_team.mothership:
-                health_matherships += new_team.mothership.health
-            if new_team.is_alive:
-                count_enemy_drones += len(new_team.drones)
-                Head.teams.append(new_team)
-        return count_enemy_drones, health_matherships
+        self._refresh()
+        return self._max_radius
 
-    @staticmethod
-    def get_role(drone: TrifonovDrone):
+    def _cell(self, x, y):
         """
-            Получит роль
+        Ячейка сетки для координат
+        """
+        column = min(max(int(x // self.cell_size), 0), self.columns - 1)
+        row = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return column, row
 
-            :return: класс роль (Role)
+    def _candidates(self, x_min, y_min, x_max, y_max, condition=None):
         """
-        if drone.role is None:
-            if Head.teams:
-                return Defender
-            else:
-                return Collector
+        Объекты из ячеек прямоугольника, расширенного на наибольший радиус и смещение объектов
 
-    @staticmethod
-    def on_heartbeat(drone: TrifonovDrone):
+        :param condition: условие для ячейки condition(column, row)
         """
-            Для вызова дроном при обработке своего события on_heartbeat.
-            В этом методе реализуется стратегия по распределеию/смене ролей дронов.
+        expand = self._max_radius + self.margin
+        column_min, row_min = self._cell(x_min - expand, y_min - expand)
+        column_max, row_max = self._cell(x_max + expand, y_max + expand)
+        for column in range(column_min, column_max + 1):
+            for row in range(row_min, row_max + 1):
+                if condition is None or condition(column, row):
+                    yield from self._cells.get((column, row), ())
+
+    def _sorted(self, objects):
+        return sorted(objects, key=lambda obj: self._order[obj.id])
+
+    def along_segment(self, a: Point, b: Point, width):
         """
-        if drone in Head.drones and not drone.is_alive:
-            drone.role = None
-            Head.drones.remove(drone)
-            return
+        Объекты, которые пересекает коридор вдоль отрезка
 
-        if not drone.is_alive:
-            return
+        :param a: начало отрезка
+        :param b: конец отрезка
+        :param width: полуширина коридора
+        :return: список объектов
+        """
+        self._refresh()
+        # ячейки, которые может задеть коридор
+        reach = width + self._max_radius + self.margin + self.cell_size / 2 * 2 ** .5
 
-        Head.radar.reflect()
-        if Head._is_new_step():
-            count_enemy_drones, health_matherships = Head._refresh_teams()
-            if count_enemy_drones == Head.count_enemy_drones and (Head.health_matherships - health_matherships) < 500:
-                Head.count_step += 5
-            else:
-                Head.count_step = 0
-                Head.count_enemy_drones = count_enemy_drones
-                Head.health_matherships = health_matherships
-            new_payload = Router.get_list_source_elerium(Head.scene)
-            if new_payload != Head.payload or Head.count_step == 0:
-                Head.game_over_tics = Head._game_over_tics
-            else:
-                Head.game_over_tics -= 1
-                if Head.game_over_tics < 0:
-                    Head.count_step = 501
-
-        if Head.count_step > 500:
-            Head.count_step = 0
-            if Combat.limit_distance == 0:
-                Combat.limit_distance = 500
-                for _drone in Head.drones:
-                    _drone.role = Combat
-                return
-            elif Combat.limit_distance < 900:
-                Combat.limit_distance += 100
-            else:
-                for _drone in Head.drones:
-                    _drone.role = Collector
-                return
+        def is_near(column, row):
+            center_x = (column + .5) * self.cell_size
+            center_y = (row + .5) * self.cell_size
+            return distance_to_segment(center_x, center_y, a, b) <= reach
 
-        if not Head.teams:
-            if not isinstance(drone.role, Collector):
-                drone.role = Collector
-                Head.count_step = 0
-        elif sum(obj.payload for obj in Router.get_list_source_elerium(Head.scene)) == 0 or len(Head.drones) <= 2:
-            if drone.payload == 0:
-                drone.role = Defender
+        candidates = self._candidates(min(a.x, b.x) - width, min(a.y, b.y) - width,
+                                      max(a.x, b.x) + width, max(a.y, b.y) + width, condition=is_near)
+        objects = [obj for obj in candidates
+                   if distance_to_segment(obj.coord.x, obj.coord.y, a, b) <= width + obj.radius]
+        return self._sorted(objects)
 
+    def nearest(self, point: Point, condition=None):
+        """
+        Ближайший к точке объект (по центру)
 
-class Router:
+        :param point: точка
+        :param condition: условие для объекта condition(obj)
+        :return: объект или None
+        """
+        self._refresh()
+        column, row = self._cell(point.x, point.y)
+        best, best_distance = None, None
+        for ring in range(max(self.columns, self.rows)):
+            # ближе, чем объекты за пределами пройденных колец, уже не найти
+            if best is not None and best_distance < ring * self.cell_size - self.cell_size - self.margin:
+                break
+            for _column in range(column - ring, column + ring + 1):
+                for _row in range(row - ring, row + ring + 1):
+                    if max(abs(_column - column), abs(_row - row)) != ring:
+                        continue
+                    for obj in self._cells.get((_column, _row), ()):
+                        if condition is not None and not condition(obj):
+                            continue
+                        distance = obj.coord.distance_to(point)
+                        if (best is None or distance < best_distance or
+                                distance == best_distance and self._order[obj.id] < self._order[best.id]):
+                            best, best_distance = obj, distance
+        return best
+
+
+class WorldArrays:
     """
-        Класс маршрутизатор
+        Класс МассивыМира.
+        Состояние объектов сцены (кроме снарядов) в массивах NumPy: координаты, радиусы, команды, живые,
+        здоровье и остаток элериума, строка объекта по его id - rows. Фильтры и расстояния считаются
+        над массивами целиком, а не обходом объектов.
+        Строится один раз за ход. Объекты двигаются и после построения, поэтому запросы по расстоянию
+        возвращают кандидатов с запасом на смещение, окончательно проверяются сами объекты.
     """
-    is_working = False
-    source_elerium = []
-    half_all_elerium = None
-
-    def __init__(self, drone: TrifonovDrone):
-        self._drone = drone
-        self._destination = None
-        self._payload = None
-        self._scheduled_free_space = None
-
-        if not Router.is_working:
-            Router.is_working = True
-            Router.half_all_elerium = Head.all_elerium // 2
+    ASTEROID, DRONE, MOTHERSHIP = 0, 1, 2
+
+    def __init__(self, head: Head):
+        self._head = head
+        self._scene = head.scene
+        # на сколько может сместиться объект за ход после построения, тот же запас, что у сетки
+        self.margin = head.grid.margin
+        # номера команд: своя - 0, без команды - -1, чужие - с 1
+        self._teams = {head.team: 0, None: -1}
+        self._step = None
+        self.objects = []
+        self.rows = {}
+        self.ids = np.empty(0, dtype=np.int64)
+        self.kind = np.empty(0, dtype=np.int8)
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.radius = np.empty(0)
+        self.team = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.health = np.empty(0)
+        self.payload = np.empty(0)
+
+    def _team(self, team):
+        """
+        Номер команды
+        """
+        return self._teams.setdefault(team, len(self._teams) - 1)
 
-    def destination(self, assume=False) -> GameObject:
+    @staticmethod
+    def _kind(obj):
         """
-        :param assume: предположить следующую точку
-        :return: координаты места назначения
+        Вид объекта
         """
-        self._refresh()
-        if assume:
-            free_space = self._scheduled_free_space
-            if not free_space and self._destination.payload < self._drone.free_space:
-                free_space = self._drone.free_space - self._destination.payload
-        else:
-            free_space = self._drone.free_space
-
-        if not free_space:
-            destination = self._drone.my_mothership
-            payload = 0
-            scheduled_free_space = self._drone.MAX_PAYLOAD
-        else:
-            destination, payload, scheduled_free_space = self._get_destination(free_space)
-
-        if not assume:
-            self._payload = payload
-            self._scheduled_free_space = scheduled_free_space
-            self._destination = destination
-
-        return destination
-
-    @property
-    def payload(self):
-        return self._payload
+        if isinstance(obj, Drone):
+            return WorldArrays.DRONE
+        if isinstance(obj, MotherShip):
+            return WorldArrays.MOTHERSHIP
+        return WorldArrays.ASTEROID
 
     def _refresh(self):
         """
-        Актулизировать список источников_элериума Router.source_elerium = [SourceElerium, ...]
+        Построить массивы, если наступил новый ход
+        """
+        step = self._head.step()
+        if self._step == step:
+            return
+        self._step = step
+        objects = [obj for obj in self._scene.objects if not isinstance(obj, PlasmaProjectile)]
+        count = len(objects)
+        self.objects = objects
+        self.rows = {obj.id: row for row, obj in enumerate(objects)}
+        self.ids = np.fromiter((obj.id for obj in objects), dtype=np.int64, count=count)
+        self.kind = np.fromiter((self._kind(obj) for obj in objects), dtype=np.int8, count=count)
+        self.x = np.fromiter((obj.coord.x for obj in objects), dtype=float, count=count)
+        self.y = np.fromiter((obj.coord.y for obj in objects), dtype=float, count=count)
+        self.radius = np.fromiter((obj.radius for obj in objects), dtype=float, count=count)
+        self.team = np.fromiter((self._team(obj.team) for obj in objects), dtype=np.int64, count=count)
+        self.alive = np.fromiter((obj.is_alive for obj in objects), dtype=bool, count=count)
+        self.health = np.fromiter((getattr(obj, "health", 0) for obj in objects), dtype=float, count=count)
+        self.payload = np.fromiter((obj.payload for obj in objects), dtype=float, count=count)
+
+    def mask(self, kinds=None, enemy=None, alive=None, has_payload=None):
+        """
+        Строки, подходящие под все заданные условия
+
+        :param kinds: виды объектов (ASTEROID, DRONE, MOTHERSHIP)
+        :param enemy: True - чужие, False - свои
+        :param alive: живые или мертвые
+        :param has_payload: есть или нет элериума
+        :return: логический массив по строкам
         """
-        Router.source_elerium = self.get_list_source_elerium(scene=self._drone.scene)
-        if Router.source_elerium:
-            for drone in Collector.drones:
-                drone.role.router.update_source_elerium()
+        self._refresh()
+        mask = np.ones(len(self.objects), dtype=bool)
+        if kinds is not None:
+            mask &= np.isin(self.kind, kinds)
+        if enemy is not None:
+            mask &= (self.team > 0) if enemy else (self.team == 0)
+        if alive is not None:
+            mask &= self.alive == alive
+        if has_payload is not None:
+            mask &= (self.payload != 0) == has_payload
+        return mask
 
-    @staticmethod
-    def get_list_source_elerium(scene):
+    def select(self, mask):
         """
-        Получить список источников элериума
-        :scene: сцена игры
-        :return: список источников элериума [SourceElerium, ...]
+        Объекты строк маски, в порядке scene.objects
+
+        :param mask: логический массив по строкам
+        :return: список объектов
         """
-        list_source_elerium = []
-        for obj in scene.objects:
-            if isinstance(obj, Asteroid) or isinstance(obj, (MotherShip, Drone)) and not obj.is_alive:
-                if obj.payload != 0:
-                    list_source_elerium.append(SourceElerium(obj))
-        return list_source_elerium
+        self._refresh()
+        return [self.objects[row] for row in np.flatnonzero(mask).tolist()]
 
-    def _get_source_elerium(self, free_space) -> SourceElerium:
+    def in_radius(self, points, radius, mask=None):
         """
-        Получить источник элериума для сбора элериума
+        Объекты, которые может пересекать окружность вокруг каждой из точек (с запасом на смещение за ход)
 
-        :param free_space: свободное место в трюме дрона
-        :return: источник элериума
+        :param points: центры окружностей [Point, ...]
+        :param radius: радиус окружностей
+        :param mask: учитывать только строки маски
+        :return: для каждой точки список объектов в порядке scene.objects
         """
-        # выбор стратегии
-        if sum(source_elerium.payload for source_elerium in Router.source_elerium) <= Router.half_all_elerium:
-            price = self.distance
-        else:
-            price = self.route_price
+        self._refresh()
+        rows = np.flatnonzero(mask) if mask is not None else np.arange(len(self.objects))
+        xs = np.array([point.x for point in points], dtype=float)
+        ys = np.array([point.y for point in points], dtype=float)
+        dx = xs[:, None] - self.x[rows]
+        dy = ys[:, None] - self.y[rows]
+        limit = radius + self.radius[rows] + self.margin
+        close = dx * dx + dy * dy <= limit * limit
+        return [[self.objects[row] for row in rows[line].tolist()] for line in close]
 
-        prices_drone_source_elerium = [
-            (self._drone, source_elerium, price(drone=self._drone, source_elerium=source_elerium,
-                                                free_space=free_space) * self.level_danger(source_elerium))
-            for source_elerium in Router.source_elerium
-        ]
-        prices_drone_source_elerium.sort(key=lambda x: x[2])
-        preferred_source_elerium = prices_drone_source_elerium[0][1]
 
-        drones = self._drone.role.get_free_drones()
-        while prices_drone_source_elerium:
-            _price = prices_drone_source_elerium.pop(0)
-            source_elerium = _price[1]
-            prices_source_elerium_drones = [
-                (drone, source_elerium, price(drone=drone, source_elerium=source_elerium, free_space=drone.free_space))
-                for drone in drones
-            ]
-            prices_source_elerium_drones.append(_price)
-            min_price = min(prices_source_elerium_drones, key=lambda x: x[2])
-            if min_price == _price:
-                preferred_source_elerium = source_elerium
-                break
-            else:
-                drones.remove(min_price[0])
+class StaticTable:
+    """
+        Класс ТаблицаСтатики.
+        Расстояния и направления между неподвижными объектами: астероидами и материнскими кораблями.
+        Строится один раз при создании головы. Для дрона, стоящего на неподвижном объекте,
+        шаги до другого неподвижного объекта берутся из таблицы, результат совпадает с TrifonovDrone.steps_to.
+    """
 
-        return preferred_source_elerium
+    def __init__(self, scene: Scene, speed=TrifonovDrone.SPEED):
+        self.objects = list(scene.asteroids) + list(scene.motherships)
+        self._index = {obj.id: index for index, obj in enumerate(self.objects)}
+        self._at = {(obj.coord.x, obj.coord.y): index for index, obj in enumerate(self.objects)}
+        count = len(self.objects)
+        self.distances = np.zeros((count, count))
+        self.directions = np.zeros((count, count))
+        self.move_steps = np.zeros((count, count), dtype=int)
+        for i, obj_i in enumerate(self.objects):
+            for j, obj_j in enumerate(self.objects):
+                vector = Vector.from_points(obj_i.coord, obj_j.coord, module=speed)
+                if not vector.module:
+                    continue
+                distance = obj_i.coord.distance_to(obj_j.coord)
+                self.distances[i, j] = distance
+                self.directions[i, j] = vector.direction
+                self.move_steps[i, j] = ceil(distance / vector.module)
 
-    def _get_destination(self, free_space):
+    def index(self, obj):
         """
-        Получить место назначение.
+        Номер неподвижного объекта в таблице
 
-        :param free_space: свободное место в трюме дрона
-        :return: место назначение (GameObject); кол-во элериума подлежащих к загрузке;
-         планируемое свободное место после погрузки
+        :param obj: объект
+        :return: номер или None, если объект не неподвижный
         """
-        if Router.source_elerium:
-            source_elerium = self._get_source_elerium(free_space)
+        return self._index.get(getattr(obj, "id", None))
 
-            payload = source_elerium.payload if source_elerium.payload <= free_space else free_space
-            scheduled_free_space = free_space - payload
-            destination = source_elerium.parent
+    def at(self, point: Point):
+        """
+        Неподвижный объект, в центре которого находится точка
 
-        elif sum(source_elerium for source_elerium in Router.source_elerium):
-            Router.source_elerium = self.get_list_source_elerium(self._drone.scene)
-            destination, payload, scheduled_free_space = self._get_destination(free_space)
+        :return: объект или None
+        """
+        index = self._at.get((point.x, point.y))
+        return None if index is None else self.objects[index]
 
-        else:
-            destination = self._drone.my_mothership
-            payload = 0
-            scheduled_free_space = self._drone.MAX_PAYLOAD
-        return destination, payload, scheduled_free_space
+    def distance(self, obj_1, obj_2):
+        """
+        Расстояние между неподвижными объектами
+        """
+        return float(self.distances[self._index[obj_1.id], self._index[obj_2.id]])
 
-    @property
-    def is_destination_valid(self):
+    def direction(self, obj_1, obj_2):
         """
-        Текущее место назначение действительно
+        Направление с первого неподвижного объекта на второй
         """
-        if self._drone.mothership == self._destination:
-            return True
-        elif hasattr(self._destination, "payload"):
-            return self._destination.payload > 0
-        else:
-            return False
+        return float(self.directions[self._index[obj_1.id], self._index[obj_2.id]])
 
     @staticmethod
-    def route_price(drone: TrifonovDrone, source_elerium: SourceElerium, free_space, **kwargs):
+    def turn_steps(heading, directions):
         """
-        Цена маршрута на единицу элериума
+        Шагов (step) для разворота с курса на направления
 
-        :param drone: дрон
-        :param source_elerium: источник элериума
-        :param free_space: свободное место в дроне
-        :return: цена маршрута да источника элериума
+        :param heading: текущий курс
+        :param directions: направления (число или массив)
         """
-        payload = source_elerium.payload if source_elerium.payload < free_space else free_space
-        return drone.steps_to(source_elerium.coord) / payload
+        return np.ceil(turn_angles(directions, heading) / TrifonovDrone.TURN_SPEED)
 
-    @staticmethod
-    def distance(drone, source_elerium, **kwargs):
+    def extension_steps(self, last, heading, candidates, home):
         """
-        Растояние до астеройда
+        На сколько шагов удлинится путь от последней остановки до материнского корабля, если зайти на кандидатов
 
-        :param drone: дрон
-        :param source_elerium: источник элериума
-        :return: количество шагов до источника элериума
+        :param last: номер последней остановки
+        :param heading: курс, с которым дрон прибудет на последнюю остановку
+        :param candidates: номера кандидатов (массив)
+        :param home: номер материнского корабля
         """
-        return drone.steps_to(source_elerium.coord)
+        to_candidates = self.directions[last, candidates]
+        via = (self.move_steps[last, candidates] + self.turn_steps(heading, to_candidates) +
+               self.move_steps[candidates, home] + self.turn_steps(to_candidates, self.directions[candidates, home]))
+        direct = self.move_steps[last, home] + self.turn_steps(heading, self.directions[last, home])
+        return via - direct
 
-    def update_source_elerium(self):
+    def round_trip_steps(self, home, candidates):
         """
-            Обновляет payload источник элериума c которым взаимодействует в Router.source_elerium
+        Шагов на отдельный рейс с материнского корабля до кандидатов и обратно
+
+        :param home: номер материнского корабля
+        :param candidates: номера кандидатов (массив)
         """
-        if isinstance(self._destination, SourceElerium):
-            payload = self._drone.MAX_PAYLOAD - self._scheduled_free_space - self._drone.payload
-            for source_elerium in Router.source_elerium:
-                if source_elerium.coord == self._destination.coord:
-                    source_elerium.payload -= payload
-                    if not source_elerium.payload:
-                        Router.source_elerium.remove(source_elerium)
-                    break
+        return (self.move_steps[home, candidates] + self.move_steps[candidates, home] +
+                self.turn_steps(self.directions[home, candidates], self.directions[candidates, home]))
 
-    def level_danger(self, source_elerium: SourceElerium):
+    def _pair(self, drone: TrifonovDrone, obj):
         """
-            Уровеннь опасности
-        :param source_elerium:источник элериума (SourceElerium)
-        :return: уровень опасности
+        Номера объекта, на котором стоит дрон, и объекта назначения
+
+        :return: (i, j) или None, если один из концов не неподвижный
         """
-        drones = [drone for drone in self._drone.scene.drones if drone.is_alive and drone.team != self._drone.team]
-        sources_elerium = self.get_list_source_elerium(self._drone.scene)
-        level = 1
-        for drone in drones:
-            if self._drone.defeat_distance(drone) < drone.coord.distance_to(source_elerium.coord):
-                continue
-            else:
-                level += 1
-            if (isinstance(drone.state, StateStopped) or
-                    (isinstance(drone.state, StateTurning) and not drone.state.move_at_target)):
-                for source in sources_elerium:
-                    if is_coord_eq(drone.coord, source.coord):
-                        break
-                else:
-                    level += 5
-        return level
+        i = self._at.get((drone.coord.x, drone.coord.y))
+        j = self.index(obj)
+        if i is None or j is None:
+            return None
+        return i, j
 
+    def _steps_to_turn(self, drone: TrifonovDrone, i, j):
+        if not self.distances[i, j]:
+            return 0
+        return ceil(turn_angle(float(self.directions[i, j]), drone.direction) / drone.TURN_SPEED)
 
-class Role(CounterStep):
-    """
-        Базовый клас Роль.
-        Обеспечивает логику дрона
-    """
+    def steps_to(self, drone: TrifonovDrone, obj):
+        """
+        Растояние от дрона до объекта в шагах (step), как TrifonovDrone.steps_to(obj.coord)
+        """
+        pair = self._pair(drone, obj)
+        if pair is None:
+            return drone.steps_to(obj.coord)
+        return int(self.move_steps[pair]) + self._steps_to_turn(drone, *pair)
+
+    def steps_to_turn(self, drone: TrifonovDrone, obj):
+        """
+        Шагов (step) для разварота дрона на объект, как TrifonovDrone.steps_to_turn(obj.coord)
+        """
+        pair = self._pair(drone, obj)
+        if pair is None:
+            return drone.steps_to_turn(obj.coord)
+        return self._steps_to_turn(drone, *pair)
+
+
+class ThreatMap:
+    """
+        Класс КартаУгроз.
+        Растр по игровому полю: в каждой ячейке уровень опасности от дронов противника, чей центр ячейки
+        достает выстрелом, плюс штраф за стоящих не у источника элериума (засада).
+        Строится массивами раз в такт, уровень опасности в точке и на отрезке - выборка из растра.
+    """
+    # штраф за дрона противника, стоящего не у источника элериума
+    AMBUSH_PENALTY = 5
+
+    def __init__(self, head: Head, cell_size=10):
+        self._head = head
+        self._scene = head.scene
+        self._team = head.team
+        self.cell_size = cell_size
+        self.columns = ceil(theme.FIELD_WIDTH / cell_size)
+        self.rows = ceil(theme.FIELD_HEIGHT / cell_size)
+        self._x = (np.arange(self.columns) + 0.5) * cell_size
+        self._y = (np.arange(self.rows) + 0.5) * cell_size
+        self._tick = None
+        self.raster = np.ones((self.columns, self.rows))
+
+    def _refresh(self, drone: TrifonovDrone):
+        """
+        Построить растр, если наступил новый такт
+
+        :param drone: свой дрон, по его оружию считается дистанция поражения
+        """
+        tick = self._head.tick()
+        if self._tick == tick:
+            return
+        self._tick = tick
+        self.raster = np.ones((self.columns, self.rows))
+        sources_elerium = self._head.world.sources
+        x, y = self._x[:, None], self._y[None, :]
+        for enemy in self._head.enemies.drones:
+            if not enemy.is_alive:
+                continue
+            level = 1
+            if (isinstance(enemy.state, StateStopped) or
+                    (isinstance(enemy.state, StateTurning) and not enemy.state.move_at_target)):
+                if not any(is_coord_eq(enemy.coord, source.coord) for source in sources_elerium):
+                    level += self.AMBUSH_PENALTY
+            reach = drone.defeat_distance(enemy)
+            self.raster += level * ((x - enemy.coord.x) ** 2 + (y - enemy.coord.y) ** 2 <= reach ** 2)
+
+    def _cell(self, x, y):
+        column = np.clip((np.asarray(x) // self.cell_size).astype(int), 0, self.columns - 1)
+        row = np.clip((np.asarray(y) // self.cell_size).astype(int), 0, self.rows - 1)
+        return column, row
+
+    def level(self, point: Point, drone: TrifonovDrone):
+        """
+        Уровень опасности в точке
+
+        :param point: точка
+        :param drone: свой дрон
+        :return: уровень опасности, 1 - опасности нет
+        """
+        self._refresh(drone)
+        return int(self.raster[self._cell(point.x, point.y)])
+
+    def level_on_segment(self, a: Point, b: Point, drone: TrifonovDrone):
+        """
+        Наибольший уровень опасности на отрезке AB
+
+        :param drone: свой дрон
+        :return: уровень опасности, 1 - опасности нет
+        """
+        self._refresh(drone)
+        count = max(ceil(a.distance_to(b) / self.cell_size), 1) + 1
+        t = np.linspace(0, 1, count)
+        return int(self.raster[self._cell(a.x + (b.x - a.x) * t, a.y + (b.y - a.y) * t)].max())
+
+
+class Scheduler:
+    """
+        Класс Планировщик.
+        Ограничивает работу дорогого перепланирования (место атаки, смена позиции, аукцион источников) за такт.
+        Работа считается в единицах, которые начисляют сами расчеты (charge), а не по часам: так решения
+        при одном сиде не зависят от загрузки машины и от включенных Profiler и TraceRecorder.
+        Срочные запросы выполняются всегда, остальные - пока не исчерпан бюджет такта.
+        Отложенный дрон сохраняет прежний план, ждущие дольше не уступают бюджет новым запросам,
+        а прождавший max_wait тактов выполняется вне бюджета.
+    """
+
+    def __init__(self, head: Head, budget=350, max_wait=3):
+        """
+        :param head: голова команды, по ней отсчитываются такты
+        :param budget: работа на перепланирование за такт, в единицах charge
+         (единица - одна проверка места атаки или перестрелка для 32 мест, в матче 30-60 мкс;
+         350 - около 10-20 мс)
+        :param max_wait: сколько тактов запрос может ждать
+        """
+        self._head = head
+        self.budget = budget
+        self.max_wait = max_wait
+        self._tick = None
+        self._spent = 0
+        # вся начисленная работа
+        self._work = 0
+        # {дрон: такт, с которого ждет}
+        self._waiting = {}
+
+    def _refresh(self):
+        """
+        Новый такт - новый бюджет. Забываются дроны, переставшие запрашивать.
+        """
+        tick = self._head.tick()
+        if tick == self._tick:
+            return
+        self._tick = tick
+        self._spent = 0
+        self._waiting = {drone: since for drone, since in self._waiting.items() if tick - since <= self.max_wait}
+
+    def _is_turn(self, drone):
+        """
+        Очередь дрона: бюджет не исчерпан, а половина бюджета оставлена тем, кто ждет дольше
+        """
+        if self._spent >= self.budget:
+            return False
+        since = self._waiting.get(drone, self._tick)
+        is_older_waiting = any(other_since < since for other_since in self._waiting.values())
+        return not is_older_waiting or self._spent < self.budget / 2
+
+    def run(self, drone: TrifonovDrone, plan, urgent=False):
+        """
+        Выполнить перепланирование, если позволяет бюджет такта
+
+        :param drone: дрон
+        :param plan: функция перепланирования без аргументов
+        :param urgent: срочно, выполнить вне бюджета
+        :return: выполнено; результат plan или None
+        """
+        self._refresh()
+        waited = self._tick - self._waiting.get(drone, self._tick)
+        if not urgent and waited < self.max_wait and not self._is_turn(drone):
+            self._waiting.setdefault(drone, self._tick)
+            return False, None
+        self._waiting.pop(drone, None)
+        begin = self._work
+        result = plan()
+        self._spent += self._work - begin
+        return True, result
+
+    def charge(self, units=1):
+        """
+        Начислить выполненную работу, вызывается из дорогих расчетов
+
+        :param units: единиц работы
+        """
+        self._work += units
+
+
+class EnemyTracker:
+    """
+        Класс УчетПротивника.
+        Постоянный учет команд соперника: списки живых дронов и материнских кораблей строятся один раз в начале игры,
+        а каждый ход из них только убираются погибшие. Отсюда берутся число дронов и здоровье кораблей соперника
+        для оценки хода игры и списки целей для ролей.
+        Между ходами цель может погибнуть, поэтому при выборе цели is_alive проверяется как и прежде.
+    """
+
+    class Team:
+        """
+            Команда соперника
+        """
+
+        def __init__(self, scene: Scene, team):
+            self.team = team
+            ships = [ship for ship in scene.motherships if ship.team == team]
+            self.mothership = ships[0] if ships else None
+            # живые дроны команды в порядке scene.drones
+            self.drones = [drone for drone in scene.drones if drone.team == team and drone.is_alive]
+
+        def update(self):
+            """
+            Убрать погибших дронов
+
+            :return: список изменился
+            """
+            if all(drone.is_alive for drone in self.drones):
+                return False
+            self.drones = [drone for drone in self.drones if drone.is_alive]
+            return True
+
+        @property
+        def is_mothership_alive(self):
+            return self.mothership is not None and self.mothership.is_alive
+
+        @property
+        def is_alive(self):
+            """
+                Команда жива
+            """
+            return bool(self.drones) or self.is_mothership_alive
+
+        @property
+        def health(self):
+            """
+                Здоровье материнского корабля, 0 - если его нет или он уничтожен
+            """
+            return self.mothership.health if self.is_mothership_alive else 0
+
+    def __init__(self, head: Head):
+        self._head = head
+        self._all_teams = [EnemyTracker.Team(head.scene, team) for team in head.scene.teams if team != head.team]
+        self._step = None
+        self._teams = []
+        self._drones = []
+        self._motherships = []
+
+    def _refresh(self):
+        """
+        Учесть потери соперника, если наступил новый ход
+        """
+        step = self._head.step()
+        if self._step == step:
+            return
+        is_first = self._step is None
+        self._step = step
+        is_changed = False
+        for team in self._all_teams:
+            is_changed = team.update() or is_changed
+        if is_changed or is_first:
+            drones = {drone for team in self._all_teams for drone in team.drones}
+            self._drones = [drone for drone in self._head.scene.drones if drone in drones]
+        self._teams = [team for team in self._all_teams if team.is_alive]
+        if is_first or any(not ship.is_alive for ship in self._motherships):
+            ships = {team.mothership for team in self._all_teams if team.is_mothership_alive}
+            self._motherships = [ship for ship in self._head.scene.motherships if ship in ships]
+
+    @property
+    def teams(self):
+        """
+        Живые команды соперника [EnemyTracker.Team, ...]
+        """
+        self._refresh()
+        return self._teams
+
+    @property
+    def drones(self):
+        """
+        Живые на начало хода дроны соперника в порядке scene.drones
+        """
+        self._refresh()
+        return self._drones
+
+    @property
+    def motherships(self):
+        """
+        Живые на начало хода материнские корабли соперника в порядке scene.motherships
+        """
+        self._refresh()
+        return self._motherships
+
+    @property
+    def count_drones(self):
+        """
+        Общее число живых дронов соперника
+        """
+        return sum(len(team.drones) for team in self.teams)
+
+    @property
+    def health_motherships(self):
+        """
+        Общее здоровье материнских кораблей соперника
+        """
+        return sum(team.health for team in self.teams)
+
+
+class CounterStep:
+    """
+        Класс СчетчикХода.
+        Имеет один метод для проверки нового хода.
+        Последний замеченный ход хранится в голове команды (head), отдельно для каждого класса.
+    """
+    head = None
+
+    def _is_new_step(self):
+        """
+        Наступил новый ход
+        """
+        step = self.head.step()
+        result = self.head.last_steps.get(type(self), 0) != step
+        if result:
+            self.head.last_steps[type(self)] = step
+        return result
+
+
+class Head(CounterStep):
+    """
+        Класс Голова.
+        Управляет дронами через назначение им ролей.
+        Содержит интерфейс для общих методов команды. В частности содержит ссылку экземпляр класса Radar.
+        Голова своя у каждой команды в каждой игре и хранит все общее состояние команды,
+        поэтому игры, сыгранные одна за другой в одном процессе, не мешают друг другу.
+    """
+    # {сцена: {команда: голова}}
+    __heads = WeakKeyDictionary()
+
+    @classmethod
+    def get_head(cls, drone: TrifonovDrone):
+        """
+        Получить голову команды дрона в его игре, первый дрон команды ее создает
+
+        :param drone: дрон
+        :return: голова (Head)
+        """
+        heads = cls.__heads.setdefault(drone.scene, {})
+        head = heads.get(drone.team)
+        if head is None:
+            head = heads[drone.team] = Head(drone)
+        head.drones.append(drone)
+        head.count_drone += 1
+        return head
+
+    def __init__(self, drone: TrifonovDrone):
+        """
+        Не использовать, для получения головы использовать функцию get_head
+        :param drone: дрон
+        """
+        self.head = self
+        self.scene = drone.scene
+        self.team = drone.team
+        self.all_elerium = sum(asteroid.payload for asteroid in drone.asteroids)
+        self.drones = []
+        # счетчик ходов: обработанных дронами тактов (heartbeat) и дронов команды
+        self.count_heartbeats = 0
+        self.count_drone = 0
+        # {класс: последний замеченный ход} для CounterStep
+        self.last_steps = {}
+
+        self.radar = Radar(self)
+        self.world = WorldSnapshot(self)
+        self.grid = SpatialGrid(self)
+        self.arrays = WorldArrays(self)
+        self.statics = StaticTable(drone.scene)
+        self.threats = ThreatMap(self)
+        self.scheduler = Scheduler(self)
+        self.enemies = EnemyTracker(self)
+
+        # общее состояние маршрутизаторов (Router)
+        self.source_elerium = []
+        self.half_all_elerium = self.all_elerium // 2
+        self.ledger = Router.Ledger()
+        # таблица резервирования {дрон: (источник элериума или None, свободное место)}
+        self.reservations = {}
+        self.reservations_key = None
+        # общее состояние сборщиков (Collector)
+        self.collectors = []
+        self.targets_for_shot = []
+        # общее состояние защитников (Defender)
+        self.defenders = []
+        self.positions = []
+        self.defender_targets = []
+        # общее состояние бойцов (Combat)
+        self.fighters = []
+        self.places_attacks = {}
+        self.limit_distance = 0
+        self.occlusion = None
+
+        #игровая статистика
+        self.count_enemy_drones, self.health_matherships = self.enemies.count_drones, self.enemies.health_motherships
+        self.payload = self.all_elerium
+        self.game_over_tics = 0
+        self.count_step = 0
+        # нужно тиков что бы дрону пролететь экран по диагонали
+        screen_diagonal = (theme.FIELD_WIDTH ** 2 + theme.FIELD_HEIGHT ** 2) ** .5
+        self._game_over_tics = int(screen_diagonal / theme.DRONE_SPEED / theme.HEARTBEAT_INTERVAL * 0.8)
+
+    def step(self):
+        """
+        Получить текущий ход
+
+        :return: текущий ход
+        """
+        # голова создается раньше, чем в ней учтен первый дрон
+        return self.count_heartbeats // max(self.count_drone, 1) * theme.HEARTBEAT_INTERVAL
+
+    def tick(self):
+        """
+        Получить номер текущего такта (heartbeat).
+        В отличие от step() одинаков для всех дронов, обрабатывающих один такт.
+
+        :return: номер такта
+        """
+        return (self.count_heartbeats - 1) // max(self.count_drone, 1)
+
+    def get_role(self, drone: TrifonovDrone):
+        """
+            Получит роль
+
+            :return: класс роль (Role)
+        """
+        if drone.role is None:
+            if self.enemies.teams:
+                return Defender
+            else:
+                return Collector
+
+    def on_heartbeat(self, drone: TrifonovDrone):
+        """
+            Для вызова дроном при обработке своего события on_heartbeat.
+            В этом методе реализуется стратегия по распределеию/смене ролей дронов.
+        """
+        if drone in self.drones and not drone.is_alive:
+            drone.role = None
+            self.drones.remove(drone)
+            return
+
+        if not drone.is_alive:
+            return
+
+        self.radar.reflect()
+        if self._is_new_step():
+            count_enemy_drones, health_matherships = self.enemies.count_drones, self.enemies.health_motherships
+            if count_enemy_drones == self.count_enemy_drones and (self.health_matherships - health_matherships) < 500:
+                self.count_step += 5
+            else:
+                self.count_step = 0
+                self.count_enemy_drones = count_enemy_drones
+                self.health_matherships = health_matherships
+            new_payload = self.world.payload
+            if new_payload != self.payload or self.count_step == 0:
+                self.payload = new_payload
+                self.game_over_tics = self._game_over_tics
+            else:
+                self.game_over_tics -= 1
+                if self.game_over_tics < 0:
+                    self.game_over_tics = self._game_over_tics
+                    self.count_step = 501
+
+        if self.count_step > 500:
+            self.count_step = 0
+            if self.limit_distance == 0:
+                self.limit_distance = 500
+                for _drone in self.drones:
+                    _drone.role = Combat
+                return
+            elif self.limit_distance < 900:
+                self.limit_distance += 100
+            else:
+                for _drone in self.drones:
+                    _drone.role = Collector
+                return
+
+        if not self.enemies.teams:
+            if not isinstance(drone.role, Collector):
+                drone.role = Collector
+                self.count_step = 0
+        elif self.world.payload == 0 or len(self.drones) <= 2:
+            if drone.payload == 0:
+                drone.role = Defender
+
+
+class Router:
+    """
+        Класс маршрутизатор.
+        Общие для всех маршрутизаторов команды список источников, журнал и таблица резервирования хранятся в голове.
+    """
+    # выбор источника: "auction" - каждый дрон для себя при запросе,
+    # "assignment" - назначение всем сборщикам раз в такт
+    assign_mode = "assignment"
+    # планировать туры: несколько астероидов за рейс, пока не заполнится трюм
+    plan_tours = True
+
+    class Ledger:
+        """
+            Журнал резервирования элериума.
+            Хранит запланированную погрузку каждого дрона по id источников.
+            Меняется только когда дрон выбирает место назначения или отказывается от него.
+        """
+
+        def __init__(self):
+            # {id источника: зарезервировано всего}
+            self._reserved = {}
+            # {дрон: {id источника: запланированная погрузка}}
+            self._plans = {}
+
+        def commit(self, drone: TrifonovDrone, stops):
+            """
+            Зарезервировать элериум источников за дроном, прежний резерв дрона снимается
+
+            :param stops: остановки [(источник элериума (объект сцены), запланированная погрузка), ...]
+            """
+            self.abandon(drone)
+            plan = {}
+            for source, payload in stops:
+                if payload > 0:
+                    plan[source.id] = plan.get(source.id, 0) + payload
+            if not plan:
+                return
+            self._plans[drone] = plan
+            for source_id, payload in plan.items():
+                self._reserved[source_id] = self._reserved.get(source_id, 0) + payload
+
+        def abandon(self, drone: TrifonovDrone):
+            """
+            Снять резерв дрона
+            """
+            plan = self._plans.pop(drone, None)
+            if plan is None:
+                return
+            for source_id, payload in plan.items():
+                self._reserved[source_id] -= payload
+                if not self._reserved[source_id]:
+                    del self._reserved[source_id]
+
+        def planned(self, drone: TrifonovDrone, source):
+            """
+            Запланированная дроном погрузка из источника
+            """
+            plan = self._plans.get(drone)
+            return plan.get(source.id, 0) if plan is not None else 0
+
+        def remaining(self, source_elerium: SourceElerium, drones=()):
+            """
+            Незарезервированный остаток источника
+
+            :param source_elerium: источник элериума
+            :param drones: дроны, чей резерв не учитывать
+            """
+            reserved = self._reserved.get(source_elerium.parent.id, 0)
+            for drone in drones:
+                reserved -= self.planned(drone, source_elerium.parent)
+            return max(source_elerium.payload - reserved, 0)
 
     def __init__(self, drone: TrifonovDrone):
         self._drone = drone
+        self._head = drone.head
+        self._destination = None
+        self._payload = None
+        self._scheduled_free_space = None
+        # тур: [[источник элериума (объект сцены), погрузка], ...], после него - материнский корабль
+        self._tour = []
+
+    def destination(self, assume=False) -> GameObject:
+        """
+        :param assume: предположить следующую точку
+        :return: координаты места назначения
+        """
+        self._refresh()
+        if Router.plan_tours:
+            self._repair_tour()
+        if assume:
+            following = [source for source, _ in self._tour if source is not self._destination]
+            if following:
+                return following[0]
+            free_space = self._scheduled_free_space
+            if not free_space and self._destination.payload < self._drone.free_space:
+                free_space = self._drone.free_space - self._destination.payload
+        else:
+            free_space = self._drone.free_space
+
+        if not free_space:
+            destination = self._drone.my_mothership
+            payload = 0
+            scheduled_free_space = self._drone.MAX_PAYLOAD
+        elif self._tour and not assume:
+            destination, payload = self._tour[0]
+            scheduled_free_space = free_space - payload
+        else:
+            destination, payload, scheduled_free_space = self._get_destination(free_space)
+
+        if not assume:
+            if not payload:
+                self._tour = []
+            elif Router.plan_tours and not self._tour:
+                self._tour = self._plan_tour(destination, payload, free_space)
+            self._payload = payload
+            self._scheduled_free_space = scheduled_free_space
+            self._destination = destination
+            self._head.ledger.commit(self._drone, self._tour if Router.plan_tours else [(destination, payload)])
+
+        return destination
+
+    @property
+    def payload(self):
+        return self._payload
+
+    def abandon(self):
+        """
+        Отказаться от места назначения и тура, резерв элериума снимается
+        """
+        self._tour = []
+        self._head.ledger.abandon(self._drone)
+
+    def on_load_start(self, source):
+        """
+        Дрон начал погрузку: остановка тура пройдена, резерв на нее снимается -
+        дальше остаток источника уменьшается сам.
+
+        :param source: источник элериума
+        """
+        if self._tour and self._tour[0][0] is source:
+            self._tour.pop(0)
+        else:
+            self._tour = []
+        self._head.ledger.commit(self._drone, self._tour)
+
+    def _repair_tour(self):
+        """
+        Починить тур: убрать опустевшие источники, погрузку пересчитать по остатку и свободному месту
+        """
+        if not self._tour:
+            return
+        remaining = {source_elerium.parent.id: source_elerium.payload for source_elerium in self._head.source_elerium}
+        capacity = self._drone.free_space
+        tour = []
+        for source, _ in self._tour:
+            payload = min(remaining.get(source.id, 0), capacity)
+            if payload > 0:
+                tour.append([source, payload])
+                capacity -= payload
+        self._tour = tour
+
+    def _plan_tour(self, source, payload, free_space):
+        """
+        Построить тур. Первая остановка уже выбрана, дальше по одному добавляются астероиды
+        с наименьшей ценой захода на единицу элериума (шаги с учетом разворотов, умноженные на уровень опасности),
+        пока есть место в трюме и заход дешевле отдельного рейса с материнского корабля.
+
+        :param source: первая остановка
+        :param payload: погрузка на первой остановке
+        :param free_space: свободное место в трюме дрона
+        :return: тур [[источник элериума, погрузка], ...]
+        """
+        tour = [[source, payload]]
+        table = self._head.statics
+        home = table.index(self._drone.my_mothership)
+        last = table.index(source)
+        if home is None or last is None:
+            return tour
+
+        vector = Vector.from_points(self._drone.coord, source.coord)
+        heading = vector.direction if vector.module else self._drone.direction
+        candidates = [source_elerium for source_elerium in self._head.source_elerium
+                      if source_elerium.parent is not source and table.index(source_elerium.parent) is not None]
+        indexes = np.array([table.index(source_elerium.parent) for source_elerium in candidates], dtype=int)
+        payloads = np.array([source_elerium.payload for source_elerium in candidates])
+        levels = np.array([self.level_danger(source_elerium) for source_elerium in candidates])
+        # цена единицы элериума при отдельном рейсе
+        dedicated = table.round_trip_steps(home, indexes) / np.minimum(payloads, self._drone.MAX_PAYLOAD)
+        is_free = np.ones(len(candidates), dtype=bool)
+        capacity = free_space - payload
+        while capacity > 0 and is_free.any():
+            loads = np.minimum(payloads, capacity)
+            per_unit = table.extension_steps(last, heading, indexes, home) / loads
+            is_worth = is_free & (per_unit <= dedicated)
+            if not is_worth.any():
+                break
+            best = int(np.argmin(np.where(is_worth, per_unit * levels, np.inf)))
+            tour.append([candidates[best].parent, int(loads[best])])
+            capacity -= int(loads[best])
+            is_free[best] = False
+            heading = table.directions[last, indexes[best]]
+            last = indexes[best]
+        return tour
+
+    def _refresh(self):
+        """
+        Актулизировать список источников_элериума source_elerium головы = [SourceElerium, ...].
+        Остаток источника уменьшен на элериум, зарезервированный другими дронами.
+        """
+        self._head.source_elerium = self.unreserved_source_elerium([self._drone])
+
+    def unreserved_source_elerium(self, drones):
+        """
+        Источники элериума с незарезервированным остатком.
+        Источник без резерва берется из снимка мира как есть.
+
+        :param drones: дроны, чей резерв не учитывать
+        :return: [SourceElerium, ...]
+        """
+        sources_elerium = []
+        for source_elerium in self._head.world.sources:
+            payload = self._head.ledger.remaining(source_elerium, drones)
+            if payload == source_elerium.payload:
+                sources_elerium.append(source_elerium)
+            elif payload:
+                sources_elerium.append(SourceElerium(source_elerium.parent, payload))
+        return sources_elerium
+
+    @staticmethod
+    def get_list_source_elerium(scene):
+        """
+        Получить список источников элериума
+        :scene: сцена игры
+        :return: список источников элериума [SourceElerium, ...]
+        """
+        return [SourceElerium(obj) for obj in scene.objects if Router.is_source_elerium(obj)]
+
+    @staticmethod
+    def is_source_elerium(obj):
+        """
+        Объект является источником элериума
+        """
+        if isinstance(obj, Asteroid) or isinstance(obj, (MotherShip, Drone)) and not obj.is_alive:
+            return obj.payload != 0
+        return False
+
+    def get_price(self):
+        """
+        Выбор стратегии: пока собрано меньше половины элериума - цена маршрута, затем расстояние
+
+        :return: функция цены (drone, source_elerium, free_space)
+        """
+        if self._head.world.payload <= self._head.half_all_elerium:
+            return Router.distance
+        return Router.route_price
+
+    def _get_source_elerium(self, free_space) -> SourceElerium:
+        """
+        Получить источник элериума для сбора элериума
+
+        :param free_space: свободное место в трюме дрона
+        :return: источник элериума
+        """
+        price = self.get_price()
+
+        prices_drone_source_elerium = [
+            (self._drone, source_elerium, price(drone=self._drone, source_elerium=source_elerium,
+                                                free_space=free_space) * self.level_danger(source_elerium))
+            for source_elerium in self._head.source_elerium
+        ]
+        prices_drone_source_elerium.sort(key=lambda x: x[2])
+        preferred_source_elerium = prices_drone_source_elerium[0][1]
+
+        drones = self._drone.role.get_free_drones()
+        while prices_drone_source_elerium:
+            _price = prices_drone_source_elerium.pop(0)
+            source_elerium = _price[1]
+            prices_source_elerium_drones = [
+                (drone, source_elerium, price(drone=drone, source_elerium=source_elerium, free_space=drone.free_space))
+                for drone in drones
+            ]
+            prices_source_elerium_drones.append(_price)
+            min_price = min(prices_source_elerium_drones, key=lambda x: x[2])
+            if min_price == _price:
+                preferred_source_elerium = source_elerium
+                break
+            else:
+                drones.remove(min_price[0])
+
+        return preferred_source_elerium
+
+    @property
+    def has_tour(self):
+        """
+        Дрон следует туру
+        """
+        return bool(self._tour)
+
+    def _get_reserved_source_elerium(self):
+        """
+        Получить источник элериума из таблицы резервирования.
+        Таблица строится заново раз в такт, при новом снимке источников (version) или смене свободного места дрона.
+        Аукцион идет через планировщик: пока он откладывает, дрон держит прежнюю бронь, если ее источник
+        не изменился; иначе аукцион срочный.
+
+        :return: источник элериума или None, если дрону источник не достался
+        """
+        key = (self._head.tick(), self._head.world.version)
+        reservation = self._head.reservations.get(self._drone)
+        if key != self._head.reservations_key or reservation is None or reservation[1] != self._drone.free_space:
+            urgent = (reservation is None or reservation[1] != self._drone.free_space or reservation[0] is None or
+                      all(source is not reservation[0] for source in self._head.world.sources))
+            is_done, _ = self._head.scheduler.run(self._drone, self.reserve, urgent=urgent)
+            if is_done:
+                self._head.reservations_key = key
+                reservation = self._head.reservations.get(self._drone)
+        return reservation[0] if reservation else None
+
+    def reserve(self):
+        """
+        Назначить источники элериума всем сборщикам, у которых есть свободное место.
+        Источник делится на ячейки по вместимости дрона, назначение ячеек дронам с минимальной
+        суммарной ценой находится венгерским алгоритмом.
+        Результат - таблица резервирования головы (reservations).
+        """
+        drones = [drone for drone in self._head.collectors if not drone.is_full and not drone.role.router.has_tour]
+        if self._drone not in drones:
+            drones.append(self._drone)
+        price = self.get_price()
+
+        slots = []
+        for source_elerium in self.unreserved_source_elerium(drones):
+            level = self.level_danger(source_elerium)
+            count_slots = min(ceil(source_elerium.payload / self._drone.MAX_PAYLOAD), len(drones))
+            for number in range(count_slots):
+                slot = source_elerium.copy()
+                slot.payload -= number * self._drone.MAX_PAYLOAD
+                slots.append((source_elerium, slot, level))
+
+        self._head.reservations = {drone: (None, drone.free_space) for drone in drones}
+        if not slots:
+            return
+        # ячейка таблицы цен - около трети проверки места атаки
+        self._head.scheduler.charge(ceil(len(drones) * len(slots) / 3))
+        costs = [[price(drone=drone, source_elerium=slot, free_space=drone.free_space) * level
+                  for _, slot, level in slots] for drone in drones]
+        for drone, index in zip(drones, assignment(costs)):
+            if index >= 0:
+                self._head.reservations[drone] = (slots[index][0], drone.free_space)
+
+    def _get_destination(self, free_space):
+        """
+        Получить место назначение.
+
+        :param free_space: свободное место в трюме дрона
+        :return: место назначение (GameObject); кол-во элериума подлежащих к загрузке;
+         планируемое свободное место после погрузки
+        """
+        if self._head.source_elerium:
+            source_elerium = None
+            if Router.assign_mode == "assignment" and free_space == self._drone.free_space:
+                source_elerium = self._get_reserved_source_elerium()
+            if source_elerium is None:
+                source_elerium = self._get_source_elerium(free_space)
+
+            payload = source_elerium.payload if source_elerium.payload <= free_space else free_space
+            scheduled_free_space = free_space - payload
+            destination = source_elerium.parent
+
+        elif sum(source_elerium for source_elerium in self._head.source_elerium):
+            self._head.source_elerium = self.get_list_source_elerium(self._drone.scene)
+            destination, payload, scheduled_free_space = self._get_destination(free_space)
+
+        else:
+            destination = self._drone.my_mothership
+            payload = 0
+            scheduled_free_space = self._drone.MAX_PAYLOAD
+        return destination, payload, scheduled_free_space
+
+    @property
+    def is_destination_valid(self):
+        """
+        Текущее место назначение действительно
+        """
+        if self._drone.mothership == self._destination:
+            return True
+        elif hasattr(self._destination, "payload"):
+            return self._destination.payload > 0
+        else:
+            return False
+
+    @staticmethod
+    def route_price(drone: TrifonovDrone, source_elerium: SourceElerium, free_space, **kwargs):
+        """
+        Цена маршрута на единицу элериума
+
+        :param drone: дрон
+        :param source_elerium: источник элериума
+        :param free_space: свободное место в дроне
+        :return: цена маршрута да источника элериума
+        """
+        payload = source_elerium.payload if source_elerium.payload < free_space else free_space
+        return drone.head.statics.steps_to(drone, source_elerium.parent) / payload
+
+    @staticmethod
+    def distance(drone, source_elerium, **kwargs):
+        """
+        Растояние до астеройда
+
+        :param drone: дрон
+        :param source_elerium: источник элериума
+        :return: количество шагов до источника элериума
+        """
+        return drone.head.statics.steps_to(drone, source_elerium.parent)
+
+    def level_danger(self, source_elerium: SourceElerium):
+        """
+            Уровеннь опасности
+        :param source_elerium:источник элериума (SourceElerium)
+        :return: уровень опасности
+        """
+        return self._head.threats.level(source_elerium.coord, self._drone)
+
+
+class Role(CounterStep):
+    """
+        Базовый клас Роль.
+        Обеспечивает логику дрона
+    """
+
+    def __init__(self, drone: TrifonovDrone):
+        self._drone = drone
+        self.head = drone.head
 
     def leave(self):
         """
@@ -713,17 +1740,16 @@ class Collector(Role):
         Роль - собирателя ресурсов
     """
     router = None
-    drones = []
-    targets_for_shot = []
 
     def __init__(self, drone):
         super(Collector, self).__init__(drone)
         self.rookie = True
-        Collector.drones.append(self._drone)
+        self.head.collectors.append(self._drone)
         self.router = Router(self._drone)
 
     def leave(self):
-        Collector.drones.remove(self._drone)
+        self.head.collectors.remove(self._drone)
+        self.router.abandon()
 
     def get_free_drones(self):
         """
@@ -731,7 +1757,7 @@ class Collector(Role):
 
         :return: [TrifonovDrone, ...]
         """
-        return [drone for drone in Collector.drones if not self.is_busy and not drone.is_full]
+        return [drone for drone in self.head.collectors if not self.is_busy and not drone.is_full]
 
     def what_to_do(self):
         if self.is_busy and not self.rookie:
@@ -747,20 +1773,28 @@ class Collector(Role):
             if (target == self._drone.move_target
                     and is_coord_eq(target.coord, self._drone.coord) and target != self._drone.mothership):
                 # уже на месте, нужно загрузить сколько влезет
-                self._drone.load_from(target)
+                self.load_from(target)
             else:
                 self._drone.move_at(target)
         self.rookie = False
 
+    def load_from(self, source):
+        """
+        Начать погрузку
+
+        :param source: источник элериума
+        """
+        self.router.on_load_start(source)
+        self._drone.load_from(source)
+
     def on_stop_at_point(self, target):
-        sources = self.router.get_list_source_elerium(self._drone.scene)
-        nearest_source = min(sources, key=lambda source: self._drone.distance_to(source.parent)) if sources else None
+        nearest_source = self.head.grid.nearest(self._drone.coord, condition=self.router.is_source_elerium)
         if nearest_source:
-            self._drone.load_from(nearest_source.parent)
+            self.load_from(nearest_source)
 
     def on_stop_at_asteroid(self, asteroid):
         if is_coord_eq(asteroid.coord, self._drone.move_target) and asteroid.payload > 0:
-            self._drone.load_from(asteroid)
+            self.load_from(asteroid)
         else:
             self.on_stop_at_point(self._drone.coord)
 
@@ -778,7 +1812,7 @@ class Collector(Role):
 
     def on_heartbeat(self):
         if self._is_new_step():
-            Collector.targets_for_shot.clear()
+            self.head.targets_for_shot.clear()
 
         if (self._drone.head.radar.health(self._drone) <= self._drone.MAX_HEALTH * 0.6 and
                 self._drone.coord.distance_to(self._drone.mothership.coord) > theme.MOTHERSHIP_HEALING_DISTANCE):
@@ -803,23 +1837,26 @@ class Collector(Role):
             Однако, если в трюмах всех дронов достаточно места для остатков элериума
             дрон будет обозначатся свободным.
         """
-        collect_all_drones = sum(source_elerium.payload for source_elerium in self.router.source_elerium) <= sum(
-            drone.free_space for drone in self.drones) and not self._drone.is_full
+        collect_all_drones = self.head.world.payload <= sum(
+            drone.free_space for drone in self.head.collectors) and not self._drone.is_full
         return self._drone.is_loading or self.is_moving_at_valid_destination or (
                 self._drone.is_unloading and not collect_all_drones)
 
     def target_fot_shot(self):
-        targets = [obj for obj in Collector.targets_for_shot if self._drone.can_hit(obj)]
+        targets = [obj for obj in self.head.targets_for_shot if self._drone.can_hit(obj)]
 
         if not targets:
-            targets = [drone for drone in self._drone.scene.drones if drone.team != self._drone.team and drone.is_alive
-                       and Head.radar.health(drone) > 0 and self._drone.can_hit(drone) and
+            near = self.head.arrays.in_radius([self._drone.coord], self._drone.defeat_distance(self._drone),
+                                              self.head.arrays.mask(kinds=WorldArrays.DRONE, enemy=True,
+                                                                    alive=True))[0]
+            targets = [drone for drone in self.head.enemies.drones if drone in near and drone.is_alive
+                       and self.head.radar.health(drone) > 0 and self._drone.can_hit(drone) and
                        (drone.coord.distance_to(drone.mothership.coord) > theme.MOTHERSHIP_HEALING_DISTANCE or
                         not drone.mothership.is_alive)]
 
         target = min(targets, key=lambda x: self._drone.steps_to_turn(x.coord)) if targets else None
-        if target and target not in Collector.targets_for_shot:
-            Collector.targets_for_shot.append(target)
+        if target and target not in self.head.targets_for_shot:
+            self.head.targets_for_shot.append(target)
         return target
 
 
@@ -827,11 +1864,9 @@ class Defender(Role):
     """
         Роль - защитник материнского корабля
     """
-    drones = []
-    positions = []
-    targets = []
-
     class Position:
+        __slots__ = ("coord", "owner")
+
         def __init__(self, coord):
             self.coord = coord
             self.owner = None
@@ -863,8 +1898,8 @@ class Defender(Role):
         super(Defender, self).__init__(drone)
         self.position = None
         self.timer_change_position = 0
-        Defender.drones.append(self._drone)
-        if not Defender.positions:
+        self.head.defenders.append(self._drone)
+        if not self.head.positions:
             self._init_place()
 
     def _init_place(self):
@@ -901,17 +1936,17 @@ class Defender(Role):
             if y < min_y or y > max_y:
                 continue
             new_position = Point(x, y)
-            if not Defender.positions:
-                Defender.positions.append(Defender.Position(new_position))
-            for position in Defender.positions:
+            if not self.head.positions:
+                self.head.positions.append(Defender.Position(new_position))
+            for position in self.head.positions:
                 if new_position.distance_to(position.coord) < self._drone.radius + self._drone.gun.projectile.radius:
                     break
             else:
-                Defender.positions.append(Defender.Position(new_position))
+                self.head.positions.append(Defender.Position(new_position))
 
     def leave(self):
         self.leave_position()
-        Defender.drones.remove(self._drone)
+        self.head.defenders.remove(self._drone)
 
     def get_position(self, can_hit=False):
         """
@@ -920,20 +1955,25 @@ class Defender(Role):
         :param can_hit: С данной позиции есть кого пострелять
         :return: позицию или None
         """
-        positions = tuple((position, self._drone.steps_to(position.coord)) for position in Defender.positions
+        positions = tuple((position, self._drone.steps_to(position.coord)) for position in self.head.positions
                           if position.is_free)
+        self.head.scheduler.charge(len(positions))
         if can_hit:
             new_positions = []
-            for position in positions:
+            arrays = self.head.arrays
+            nears = arrays.in_radius([position[0].coord for position in positions],
+                                     self._drone.defeat_distance(self._drone),
+                                     arrays.mask(kinds=WorldArrays.DRONE, enemy=True, alive=True))
+            for position, near in zip(positions, nears):
                 coord = position[0].coord
-                for drone in self._drone.scene.drones:
-                    if (drone.team != self._drone.team and drone.is_alive and Head.radar.health(drone) > 0 and
+                for drone in near:
+                    if (drone.is_alive and self.head.radar.health(drone) > 0 and
                             drone.coord.distance_to(coord) <= self._drone.defeat_distance(drone)):
                         new_positions.append(position)
                         break
                 if not new_positions:
-                    for ship in self._drone.scene.motherships:
-                        if (ship.team != self._drone.team and ship.is_alive
+                    for ship in self.head.enemies.motherships:
+                        if (ship.is_alive
                                 and ship.coord.distance_to(coord) <= self._drone.defeat_distance(ship)):
                             new_positions.append(position)
                             break
@@ -954,8 +1994,7 @@ class Defender(Role):
             target = self.get_target()
             if target is None:
                 self.timer_change_position += 1
-                if self.timer_change_position > 4:
-                    self.change_position()
+                if self.timer_change_position > 4 and self.change_position():
                     self.timer_change_position = 0
             else:
                 self._drone.shot(target)
@@ -966,26 +2005,28 @@ class Defender(Role):
 
         :return: цель (Drone, Mothership)
         """
-        targets = [obj for obj in Defender.targets if self._drone.can_hit(obj)]
+        targets = [obj for obj in self.head.defender_targets if self._drone.can_hit(obj)]
 
         if not targets:
-            targets = [drone for drone in self._drone.scene.drones if drone.team != self._drone.team and drone.is_alive
-                       and Head.radar.health(drone) > 0 and self._drone.can_hit(drone) and
+            near = self.head.arrays.in_radius([self._drone.coord], self._drone.defeat_distance(self._drone),
+                                              self.head.arrays.mask(kinds=WorldArrays.DRONE, enemy=True,
+                                                                    alive=True))[0]
+            targets = [drone for drone in self.head.enemies.drones if drone in near and drone.is_alive
+                       and self.head.radar.health(drone) > 0 and self._drone.can_hit(drone) and
                        (drone.coord.distance_to(drone.mothership.coord) > theme.MOTHERSHIP_HEALING_DISTANCE or
                         not drone.mothership.is_alive)]
 
         if not targets:
-            targets = [ship for ship in self._drone.scene.motherships if ship.team != self._drone.team
-                       and ship.is_alive and self._drone.can_hit(ship)]
+            targets = [ship for ship in self.head.enemies.motherships if ship.is_alive and self._drone.can_hit(ship)]
 
         target = min(targets, key=lambda x: self._drone.mothership.coord.distance_to(x.coord)) if targets else None
-        if target and target not in Defender.targets:
-            Defender.targets.append(target)
+        if target and target not in self.head.defender_targets:
+            self.head.defender_targets.append(target)
         return target
 
     def on_heartbeat(self):
         if self._is_new_step():
-            Defender.targets.clear()
+            self.head.defender_targets.clear()
 
         if self._drone.head.radar.health(self._drone) <= self._drone.MAX_HEALTH * 0.5:
             self.leave_position()
@@ -1003,12 +2044,15 @@ class Defender(Role):
     def change_position(self):
         """
         Сменить позицию, на ту что позволяет вести огонь
+
+        :return: поиск позиции выполнен, False - отложен планировщиком
         """
-        position = self.get_position(can_hit=True)
+        is_done, position = self.head.scheduler.run(self._drone, lambda: self.get_position(can_hit=True))
         if position:
             self.leave_position()
             position.occupy(self)
             self._drone.move_at(self.position.coord)
+        return is_done
 
 
 class Radar:
@@ -1016,23 +2060,91 @@ class Radar:
      Класс Радар, на данный момент система предупреждения о попадании
     """
 
-    def __init__(self, scene: Scene, team):
-        self._scene = scene
-        self.team = team
+    class Prediction:
+        """
+            Прогноз попадания снаряда.
+            Действителен, пока на оставшемся пути снаряда не появился новый объект
+            и не сдвинулся ни один из учтенных.
+        """
+        __slots__ = ("ttl", "is_moving", "end_point", "objects", "hit_obj", "step", "damage", "_grid")
+
+        def __init__(self, projectile: PlasmaProjectile, grid: SpatialGrid):
+            conditional = ConditionalProjectile(projectile, grid)
+            self._grid = grid
+            self.ttl = projectile.ttl
+            self.is_moving = conditional.is_moving
+            self.end_point = conditional.target_point if conditional.is_moving else conditional.coord.copy()
+            self.objects = [(obj, obj.coord.x, obj.coord.y, obj.is_alive) for obj in conditional.objects]
+            conditional.result()
+            self.hit_obj = conditional.hit_obj
+            self.step = conditional.step
+            self.damage = conditional.damage
+
+        def steps_to_hit(self, projectile: PlasmaProjectile):
+            """
+            Ходов до попадания (снаряд отсчитывает ttl каждый ход)
+            """
+            return self.step - (self.ttl - projectile.ttl)
+
+        def is_valid(self, projectile: PlasmaProjectile):
+            """
+            Прогноз действителен
+            """
+            if self.hit_obj is not None and self.steps_to_hit(projectile) < 1:
+                return False
+            # снаряд мог начать движение уже после прогноза
+            if self.is_moving != isinstance(projectile.state, StateMoving):
+                return False
+            for obj, x, y, is_alive in self.objects:
+                if obj.coord.x != x or obj.coord.y != y or obj.is_alive != is_alive:
+                    return False
+            known = {obj.id for obj, *_ in self.objects}
+            for obj in self._grid.along_segment(projectile.coord, self.end_point, projectile.radius):
+                if obj.id not in known:
+                    return False
+            return True
+
+    def __init__(self, head: Head):
+        self._head = head
+        self._scene = head.scene
+        self.team = head.team
         self.hits = []
+        self._tick = None
+        self._predictions = {}
+        # попадания по целям {id цели: [(ход, урон), ...]}, отсортированы по ходу
+        self._timeline = {}
+        # прогноз здоровья на текущий такт {id дрона: здоровье}
+        self._health = {}
 
     def reflect(self):
         """
-        Фиксация выстрелов и их предполагаемых результатов
+        Фиксация выстрелов и их предполагаемых результатов.
+        Выполняется один раз за такт, прогнозы снарядов пересчитываются только если они устарели.
         """
+        tick = self._head.tick()
+        if self._tick == tick:
+            return
+        self._tick = tick
+
+        predictions = {}
         self.hits = []
         for obj in self._scene.objects:
             if not isinstance(obj, PlasmaProjectile) or not obj.is_alive:
                 continue
-            projectile = ConditionalProjectile(obj)
-            projectile.result()
-            if projectile.hit_obj:
-                self.hits.append((projectile.hit_obj, projectile.step, projectile.damage))
+            prediction = self._predictions.get(obj.id)
+            if prediction is None or not prediction.is_valid(obj):
+                prediction = Radar.Prediction(obj, self._head.grid)
+            predictions[obj.id] = prediction
+            if prediction.hit_obj:
+                self.hits.append((prediction.hit_obj, prediction.steps_to_hit(obj), prediction.damage))
+        self._predictions = predictions
+
+        self._timeline = {}
+        for hit_obj, step, damage in self.hits:
+            self._timeline.setdefault(hit_obj.id, []).append((step, damage))
+        for timeline in self._timeline.values():
+            timeline.sort(key=lambda hit: hit[0])
+        self._health = {}
 
     def health(self, drone: Drone):
         """
@@ -1041,18 +2153,35 @@ class Radar:
         :param drone: дрон
         :return: здоровье
         """
+        health = self._health.get(drone.id)
+        if health is None:
+            health = self._predict_health(drone)
+            self._health[drone.id] = health
+        return health
+
+    def _predict_health(self, drone: Drone):
+        """
+        Расчет прогноза здоровья за один проход по попаданиям в дрон
+        """
         health = drone.health
-        hits = [hit for hit in self.hits if hit[0] == drone]
+        timeline = self._timeline.get(drone.id)
+        if not timeline:
+            return health
+        gain = self.health_gain_per_turn(drone)
         step = 0
-        while hits:
-            step += 1
-            for hit in hits.copy():
-                if step == hit[1]:
-                    health -= hit[2]
-                    hits.remove(hit)
+        index = 0
+        while index < len(timeline):
+            hit_step = timeline[index][0]
+            # ходы без попаданий - только восстановление
+            if hit_step - 1 > step:
+                health = min(theme.DRONE_MAX_SHIELD, health + gain * (hit_step - 1 - step))
+            while index < len(timeline) and timeline[index][0] == hit_step:
+                health -= timeline[index][1]
+                index += 1
             if health <= 0:
                 break
-            health = min(theme.DRONE_MAX_SHIELD, health + self.health_gain_per_turn(drone))
+            health = min(theme.DRONE_MAX_SHIELD, health + gain)
+            step = hit_step
         return health
 
     @staticmethod
@@ -1073,15 +2202,16 @@ class ConditionalProjectile:
     """
     Класс условный сняряд, используется для Радара
     """
+    __slots__ = ("coord", "direction", "ttl", "radius", "owner", "step", "hit_obj", "is_moving", "target_point",
+                 "vector", "objects")
 
-    def __init__(self, obj, **kwargs):
+    def __init__(self, obj, grid: SpatialGrid, **kwargs):
         projectile = obj
         self.coord = projectile.coord.copy()
         self.direction = projectile.direction
         self.ttl = projectile.ttl
         self.radius = projectile.radius
         self.owner = projectile.owner
-        self.objects = projectile.scene.objects
         self.step = 0
         self.hit_obj = None
 
@@ -1093,6 +2223,9 @@ class ConditionalProjectile:
             self.is_moving = False
             self.target_point = None
             self.vector = None
+        # объекты, которые снаряд может задеть на оставшемся пути
+        end_point = self.target_point if self.is_moving else self.coord
+        self.objects = grid.along_segment(self.coord, end_point, self.radius)
 
     @property
     def damage(self):
@@ -1105,14 +2238,102 @@ class ConditionalProjectile:
 
     def result(self):
         """
-        Результат выстерела
+        Результат выстерела.
+        Снаряд летит по прямой с постоянной скоростью, а объекты считаются неподвижными,
+        поэтому ход попадания в каждый объект находится из квадратного уравнения,
+        без пошаговой симуляции полета (game_step).
 
         :return: объект куда попали, сколько ходов до попадания
         """
-        while self.is_alive:
-            self.game_step()
+        if not self.is_alive:
+            return self.hit_obj, self.step
+
+        # полных шагов полета и ход, на котором снаряд останавливается в конечной точке
+        if self.is_moving and self.vector.module:
+            count_steps = min(floor(self.coord.distance_to(self.target_point) / self.vector.module), self.ttl)
+            end_point = self.target_point
+        else:
+            count_steps = 0
+            end_point = self.coord
+        end_step = count_steps + 1 if count_steps < self.ttl else None
+
+        hit_obj, hit_step = None, None
+        for obj in self.objects:
+            if not self._can_damage(obj):
+                continue
+            step = self._impact_step(obj, count_steps, end_point, end_step)
+            if step is not None and (hit_step is None or step < hit_step):
+                hit_obj, hit_step = obj, step
+
+        if hit_obj is None:
+            self.step += self.ttl
+            if end_step is not None:
+                self.coord = end_point.copy()
+            elif count_steps:
+                self.coord += Vector(self.vector.x * count_steps, self.vector.y * count_steps)
+        else:
+            self.step += hit_step
+            self.hit_obj = hit_obj
+            if hit_step == end_step:
+                self.coord = end_point.copy()
+            else:
+                self.coord += Vector(self.vector.x * hit_step, self.vector.y * hit_step)
+        self.ttl = 0
+        self.is_moving = False
         return self.hit_obj, self.step
 
+    def _impact_step(self, obj, count_steps, end_point, end_step):
+        """
+        Ход попадания в объект
+
+        :param obj: объект
+        :param count_steps: полных шагов полета
+        :param end_point: конечная точка полета
+        :param end_step: ход остановки в конечной точке (None - не долетит за время жизни)
+        :return: номер хода или None
+        """
+        if count_steps:
+            # |coord + step * vector - obj.coord| <= summa_radius - 2
+            limit = obj.radius + self.radius - 2
+            delta_x = self.coord.x - obj.coord.x
+            delta_y = self.coord.y - obj.coord.y
+            a = self.vector.x ** 2 + self.vector.y ** 2
+            b = 2 * (delta_x * self.vector.x + delta_y * self.vector.y)
+            c = delta_x ** 2 + delta_y ** 2 - limit ** 2
+            discriminant = b ** 2 - 4 * a * c
+            if limit >= 0 and discriminant >= 0:
+                first_step = max(ceil((-b - discriminant ** .5) / (2 * a)), 1)
+                # уточнение на случай погрешности вычислений
+                for step in range(max(first_step - 1, 1), min(first_step + 1, count_steps) + 1):
+                    if self._is_overlap(obj, self.coord.x + self.vector.x * step, self.coord.y + self.vector.y * step):
+                        return step
+        if end_step is not None and self._is_overlap(obj, end_point.x, end_point.y):
+            return end_step
+        return None
+
+    def _can_damage(self, obj):
+        """
+        Снаряд может нанести урон объекту (правила огня по своим)
+        """
+        if not hasattr(obj, "damage_taken") or obj.team is None or not obj.is_alive:
+            return False
+        if theme.TEAM_DRONES_FRIENDLY_FIRE:
+            # Не наносим урон себе
+            return obj.id != self.owner.id
+        # Пролетаем свои объекты
+        return obj.team != self.owner.team
+
+    def _is_overlap(self, obj, x, y):
+        """
+        Снаряд в точке (x, y) перекрывает объект
+        """
+        summa_radius = obj.radius + self.radius
+        if abs(obj.coord.x - x) > summa_radius and abs(obj.coord.y - y) > summa_radius:
+            return False
+        distance = sqrt((x - obj.coord.x) ** 2 + (y - obj.coord.y) ** 2)
+        overlap_distance = int(summa_radius - distance)
+        return overlap_distance > 1
+
     def _step(self):
         """
         Полет снаряда за ход игры
@@ -1131,27 +2352,10 @@ class ConditionalProjectile:
         """
         self.step += 1
         self.ttl = max(self.ttl - 1, 0)
-        self._step()
-        # проверка на попадание в объект
-        for obj in self.objects:
-
-            if not hasattr(obj, "damage_taken") or obj.team is None or not obj.is_alive:
-                continue
-            if theme.TEAM_DRONES_FRIENDLY_FIRE:
-                # Не наносим урон себе
-                if obj.id == self.owner.id:
-                    continue
-            else:
-                # Пролетаем свои объекты
-                if obj.team == self.owner.team:
-                    continue
-
-            summa_radius = obj.radius + self.radius
-            if abs(obj.coord.x - self.coord.x) > summa_radius and abs(obj.coord.y - self.coord.y) > summa_radius:
-                continue
-            distance = self.coord.distance_to(obj.coord)
-            overlap_distance = int(summa_radius - distance)
-            if overlap_distance > 1:
+        self._step()
+        # проверка на попадание в объект
+        for obj in self.objects:
+            if self._can_damage(obj) and self._is_overlap(obj, self.coord.x, self.coord.y):
                 # попадание
                 self.ttl = 0
                 self.is_moving = False
@@ -1167,16 +2371,261 @@ class Combat(Role):
     """
     Роль - боец
     """
-    drones = []
-    places_attacks = {}
-    limit_distance = 0
+    # режим поиска места атаки: "grid" - полный перебор сетки, "vector" - оценка массивами с уточнением.
+    # Уточнение мелкой сеткой дает другие места, чем "grid", и меняет ход боя, не только скорость поиска;
+    # сравнение на уровне матчей: match_runner.py --place-search grid|vector
+    place_search = "vector"
+    # на сколько могут сместиться цель, боец и тела у линии огня, чтобы найденное место не искать заново
+    place_tolerance = 20
+
+    class Line:
+        """
+            Линия огня с занятого места атаки.
+            Дрон на этом месте - препятствие для других линий огня.
+        """
+        __slots__ = ("drone", "coord", "target", "id", "radius", "order", "hit_obj", "hit_key")
+
+        def __init__(self, drone: TrifonovDrone, coord, target, order):
+            self.drone = drone
+            self.coord = coord.copy()
+            self.target = target
+            self.id = drone.id
+            self.radius = drone.radius
+            self.order = order
+            self.hit_obj = None
+            self.hit_key = None
+
+    class Plan:
+        """
+            Место атаки, найденное поиском, и обстановка при поиске: откуда шел боец, где была цель,
+            тела у линии огня, места, занятые другими бойцами, и ограничение дальности головы.
+            Место переходит из хода в ход, пока обстановка не изменилась больше чем на place_tolerance.
+        """
+        __slots__ = ("target", "place", "origin", "target_coord", "bodies", "places", "limit_distance")
+
+        def __init__(self, drone: TrifonovDrone, target, place: Point, bodies, places, limit_distance):
+            self.target = target
+            self.place = place
+            self.origin = drone.coord.copy()
+            self.target_coord = target.coord.copy()
+            self.bodies = bodies
+            self.places = places
+            self.limit_distance = limit_distance
+
+        def is_actual(self, drone: TrifonovDrone, target, limit_distance):
+            """
+            Цель та же, ни она, ни боец не сместились, ограничение дальности не изменилось?
+            Боец, идущий к месту, остается на отрезке от точки поиска до места.
+            """
+            tolerance = Combat.place_tolerance
+            return (target is self.target and limit_distance == self.limit_distance and
+                    target.coord.distance_to(self.target_coord) <= tolerance and
+                    distance_to_segment(drone.coord.x, drone.coord.y, self.origin, self.place) <= tolerance)
+
+        def is_same_surroundings(self, bodies, places):
+            """
+            У линии огня те же тела, другие бойцы на тех же местах, и ничто не сместилось и не погибло?
+
+            :param bodies: тела у линии огня сейчас {id: (x, y, живой)}
+            :param places: занятые другими бойцами места сейчас {(id цели, id бойца): (x, y, True)}
+            """
+            for current, previous in ((bodies, self.bodies), (places, self.places)):
+                if current.keys() != previous.keys():
+                    return False
+                for key, (x, y, is_alive) in current.items():
+                    x_0, y_0, is_alive_0 = previous[key]
+                    if is_alive != is_alive_0 or distance_between(x, y, x_0, y_0) > Combat.place_tolerance:
+                        return False
+            return True
+
+    class Occlusion:
+        """
+            Перекрытия линий огня с занятых мест атаки (places_attacks головы) в текущем ходе.
+            Для каждой линии хранится объект, в который попадет выстрел: дрон на другом занятом месте
+            или живой дрон (корабль), не участвующий в атаке.
+            При занятии нового места пересчитываются только линии, которые оно перекрывает.
+        """
+
+        def __init__(self, head: Head):
+            self._head = head
+            self._scene = head.scene
+            self._key = None
+            self._others = []
+            self._snapshot = None
+            self._bodies = []
+            self._arrays = None
+            self.lines = []
+
+        def _take_snapshot(self):
+            """
+            Положение препятствий. Дроны двигаются и между тактами соседей, а место, занятое
+            на текущей позиции дрона, движется вместе с ним.
+            """
+            return ([(obj.coord.x, obj.coord.y, obj.is_alive) for obj in self._others] +
+                    [(place.x, place.y) for place in self._places()])
+
+        def _places(self):
+            """
+            Текущие координаты занятых мест, в порядке линий
+            """
+            return [self._head.places_attacks[line.target][line.drone] for line in self.lines]
+
+        def _refresh(self):
+            """
+            Обновить препятствия, если они сдвинулись или сменился состав бойцов
+            """
+            key = tuple(drone.id for drone in self._head.fighters)
+            if key != self._key:
+                self._key = key
+                arrays = self._head.arrays
+                self._others = [obj for obj in arrays.select(arrays.mask(kinds=(WorldArrays.DRONE,
+                                                                                WorldArrays.MOTHERSHIP)))
+                                if obj not in self._head.fighters]
+                self._snapshot = None
+            snapshot = self._take_snapshot()
+            if snapshot == self._snapshot:
+                return
+            self._snapshot = snapshot
+            self._bodies = [obj for obj in self._others if obj.is_alive]
+            for line, place in zip(self.lines, self._places()):
+                line.coord = place.copy()
+            self._arrays = None
+            self._update_hits(self.lines)
+
+        def _obstacles(self):
+            """
+            Препятствия в порядке проверки: дроны на занятых местах, затем прочие
+            """
+            return self.lines + self._bodies
+
+        def _rank(self, obj):
+            """
+            Порядок препятствия, при равном расстоянии попадает в первое
+            """
+            if isinstance(obj, Combat.Line):
+                return obj.order
+            return float("inf"), self._bodies.index(obj)
+
+        def _update_hits(self, lines):
+            """
+            Пересчитать попадания с линий огня по всем препятствиям
+            """
+            if not lines:
+                return
+            obstacles = self._obstacles()
+            if self._arrays is None:
+                self._arrays = objects_arrays(obstacles)
+            indexes = first_hits(places=[(line.coord.x, line.coord.y) for line in lines],
+                                 targets=[(line.target.coord.x, line.target.coord.y) for line in lines],
+                                 shooter_ids=[line.id for line in lines],
+                                 radius_projectile=[line.drone.gun.projectile.radius for line in lines],
+                                 centers=self._arrays[0], radii=self._arrays[1], ids=self._arrays[2])
+            for line, index in zip(lines, indexes):
+                if index < 0:
+                    line.hit_obj, line.hit_key = None, None
+                else:
+                    line.hit_obj = obstacles[index]
+                    line.hit_key = line.coord.distance_to(line.hit_obj.coord) - line.hit_obj.radius
+
+        def _intercepted(self, drone, place: Point, rank):
+            """
+            Линии огня, которые перекроет дрон на месте place
+
+            :param rank: порядок дрона среди препятствий
+            :return: список (линия, ключ попадания)
+            """
+            if not self.lines:
+                return []
+            indexes = first_hits(places=[(line.coord.x, line.coord.y) for line in self.lines],
+                                 targets=[(line.target.coord.x, line.target.coord.y) for line in self.lines],
+                                 shooter_ids=[line.id for line in self.lines],
+                                 radius_projectile=[line.drone.gun.projectile.radius for line in self.lines],
+                                 centers=np.array([(place.x, place.y)], dtype=float),
+                                 radii=np.array([drone.radius], dtype=float),
+                                 ids=np.array([drone.id], dtype=np.int64))
+            result = []
+            for line, index in zip(self.lines, indexes):
+                if index < 0:
+                    continue
+                key = line.coord.distance_to(place) - drone.radius
+                if line.hit_obj is None or key < line.hit_key or \
+                        (key == line.hit_key and rank < self._rank(line.hit_obj)):
+                    result.append((line, key))
+            return result
+
+        def is_valid(self, drone, place: Point, target):
+            """
+            После занятия места все линии огня, включая новую, попадают в цель?
+
+            :param drone: атакующий дрон
+            :param place: место атаки
+            :param target: цель
+            """
+            self._refresh()
+            if any(target != line.hit_obj for line in self.lines):
+                return False
+            obstacles = self._obstacles()
+            if self._arrays is None:
+                self._arrays = objects_arrays(obstacles)
+            index = first_hits(places=[(place.x, place.y)], targets=[(target.coord.x, target.coord.y)],
+                               shooter_ids=[drone.id], radius_projectile=drone.gun.projectile.radius,
+                               centers=self._arrays[0], radii=self._arrays[1], ids=self._arrays[2])[0]
+            if index < 0 or target != obstacles[index]:
+                return False
+            # новое место проверяется первым, поэтому перекрывает линию и при равном расстоянии
+            return not self._intercepted(drone, place, rank=(-1, -1))
+
+        def hits_target(self, drone, xs, ys, target):
+            """
+            Часть is_valid сразу для многих мест: линии огня с занятых мест попадают в цель (от места
+            не зависит), и выстрел с места первым попадает в цель. Места, не прошедшие проверку,
+            is_valid отклонил бы. Начисляет планировщику работу по числу мест: примерно 32 места
+            стоят одной проверки места атаки.
+
+            :param xs: координаты x мест
+            :param ys: координаты y мест
+            :return: логический массив по местам
+            """
+            self._refresh()
+            if not len(xs) or any(target != line.hit_obj for line in self.lines):
+                return np.zeros(len(xs), dtype=bool)
+            self._head.scheduler.charge(ceil(len(xs) / 32))
+            obstacles = self._obstacles()
+            if self._arrays is None:
+                self._arrays = objects_arrays(obstacles)
+            indexes = first_hits(places=np.column_stack((xs, ys)),
+                                 targets=np.tile((target.coord.x, target.coord.y), (len(xs), 1)),
+                                 shooter_ids=np.full(len(xs), drone.id), radius_projectile=drone.gun.projectile.radius,
+                                 centers=self._arrays[0], radii=self._arrays[1], ids=self._arrays[2])
+            return np.array([index >= 0 and target == obstacles[index] for index in indexes.tolist()], dtype=bool)
+
+        def add(self, drone, place: Point, target, order):
+            """
+            Занять место атаки
+
+            :param order: порядок места в places_attacks головы (номер цели, номер места)
+            """
+            self._refresh()
+            line = Combat.Line(drone, place, target, order)
+            for other, key in self._intercepted(drone, place, rank=order):
+                other.hit_obj, other.hit_key = line, key
+            self.lines.append(line)
+            self.lines.sort(key=lambda x: x.order)
+            self._arrays = None
+            self._update_hits([line])
+            self._snapshot = self._take_snapshot()
 
     def __init__(self, drone):
         super().__init__(drone)
-        Combat.drones.append(self._drone)
+        # прежний план: цель и место атаки
+        self._target = None
+        self._place = None
+        # последнее найденное поиском место (Combat.Plan)
+        self._plan = None
+        self.head.fighters.append(self._drone)
 
     def leave(self):
-        Combat.drones.remove(self._drone)
+        self.head.fighters.remove(self._drone)
 
     def what_to_do(self):
         target = self.get_target()
@@ -1200,11 +2649,11 @@ class Combat(Role):
 
         :return: цель (Drone, Mothership)
         """
-        targets = [drone for drone in Head.scene.drones if drone.team != self._drone.team and drone.is_alive and
-                   Head.radar.health(drone) > 0]
+        targets = [drone for drone in self.head.enemies.drones if drone.is_alive and
+                   self.head.radar.health(drone) > 0]
 
         if not targets:
-            targets = [ship for ship in Head.scene.motherships if ship.team != self._drone.team and ship.is_alive]
+            targets = [ship for ship in self.head.enemies.motherships if ship.is_alive]
         if not targets:
             return None
 
@@ -1213,7 +2662,7 @@ class Combat(Role):
         else:
             koef = 0
         dict_target = {}
-        for drone in Combat.drones:
+        for drone in self.head.fighters:
             for target in targets:
                 dict_target[target] = (dict_target.setdefault(target, 0) + drone.steps_to(target.coord) * koef)
         for target in targets:
@@ -1235,39 +2684,187 @@ class Combat(Role):
         :return: место (Point или None)
         """
         defeat_distance = self._drone.defeat_distance(target)
-        dict_places = Combat.places_attacks.setdefault(target, {})
+        dict_places = self.head.places_attacks.setdefault(target, {})
         if not dict_places:
-            for drone in Combat.drones:
+            for drone in self.head.fighters:
                 distance_to_target = drone.coord.distance_to(target.coord)
                 if distance_to_target <= defeat_distance:
                     place = drone.coord
                     if self.is_place_valid(drone, place, target):
-                        dict_places[drone] = place
+                        self.take_place(drone, place, target)
         place = dict_places.get(self._drone)
         if place:
             return place
 
-        step_find = self._drone.radius * 2
+        # найденное раньше место годится, пока обстановка не изменилась: только проверка, без поиска
+        plan = self._plan
+        if (plan is not None and plan.is_actual(self._drone, target, self.head.limit_distance) and
+                plan.is_same_surroundings(self.bodies_at_line_of_fire(plan.place, target), self.claimed_places()) and
+                self.is_place_valid(self._drone, plan.place, target)):
+            self._target, self._place = target, plan.place
+            self.take_place(self._drone, plan.place, target)
+            return plan.place
+
+        # прежнее место сохраняется, пока планировщик не даст очередь на поиск
+        is_same_plan = (target is self._target and self._place is not None and
+                        self.is_place_valid(self._drone, self._place, target))
+        is_under_fire = self.head.radar.health(self._drone) < self._drone.health
+        is_done, optimal_place = self.head.scheduler.run(self._drone,
+                                                         lambda: self._find_place(target, defeat_distance),
+                                                         urgent=not is_same_plan or is_under_fire)
+        if not is_done:
+            optimal_place = self._place
+        elif optimal_place:
+            self._plan = Combat.Plan(self._drone, target, optimal_place,
+                                     self.bodies_at_line_of_fire(optimal_place, target), self.claimed_places(),
+                                     self.head.limit_distance)
+        else:
+            self._plan = None
+        self._target, self._place = target, optimal_place
+        if optimal_place:
+            self.take_place(self._drone, optimal_place, target)
+        return optimal_place
+
+    def _find_place(self, target, defeat_distance):
+        """
+        Поиск места атаки способом Combat.place_search
+
+        :return: место (Point или None)
+        """
+        if Combat.place_search == "grid":
+            return self._find_place_grid(target, defeat_distance)
+        return self._find_place_vector(target, defeat_distance)
+
+    def take_place(self, drone, place: Point, target):
+        """
+        Занять место атаки
+
+        :param drone: атакующий дрон
+        :param place: место атаки
+        :param target: цель
+        """
+        dict_places = self.head.places_attacks.setdefault(target, {})
+        order = (list(self.head.places_attacks).index(target), len(dict_places))
+        dict_places[drone] = place
+        self.get_occlusion().add(drone, place, target, order)
+
+    def bodies_at_line_of_fire(self, place: Point, target):
+        """
+        Тела, которые могут оказаться на линии огня с места по цели (кроме бойца и цели)
+
+        :return: {id: (x, y, живой)}
+        """
+        width = 2 * self._drone.gun.projectile.radius + self.head.grid.max_radius
+        return {obj.id: (obj.coord.x, obj.coord.y, obj.is_alive)
+                for obj in self.head.grid.along_segment(place, target.coord, width)
+                if obj is not self._drone and obj is not target}
+
+    def claimed_places(self):
+        """
+        Места атаки, занятые другими бойцами в текущем ходе
+
+        :return: {(id цели, id бойца): (x, y, True)}
+        """
+        return {(target.id, drone.id): (place.x, place.y, True)
+                for target, dict_places in self.head.places_attacks.items()
+                for drone, place in dict_places.items() if drone is not self._drone}
+
+    def get_occlusion(self):
+        """
+        Перекрытия линий огня текущего хода
+        """
+        if self.head.occlusion is None:
+            self.head.occlusion = Combat.Occlusion(self.head)
+        return self.head.occlusion
+
+    def _place_bounds(self, target, defeat_distance):
+        """
+        Границы области поиска места атаки
+
+        :return: min_x, max_x, min_y, max_y
+        """
         min_x = max(ceil(-defeat_distance + target.x), self._drone.radius)
         max_x = min(floor(defeat_distance + target.x), theme.FIELD_WIDTH - self._drone.radius)
         min_y = max(ceil(-defeat_distance + target.y), self._drone.radius)
         max_y = min(floor(defeat_distance + target.y), theme.FIELD_HEIGHT - self._drone.radius)
+        return min_x, max_x, min_y, max_y
+
+    def _find_place_grid(self, target, defeat_distance):
+        """
+        Поиск места атаки полным перебором узлов сетки
+
+        :param target: цель
+        :param defeat_distance: дистанция поражения цели
+        :return: место (Point или None)
+        """
+        step_find = self._drone.radius * 2
+        min_x, max_x, min_y, max_y = self._place_bounds(target, defeat_distance)
 
         min_distance_to_place = None
         optimal_place = None
         for x in range(min_x, max_x, step_find):
             for y in range(min_y, max_y, step_find):
+                if defeat_distance ** 2 - ((target.coord.x - x) ** 2 + (target.coord.y - y) ** 2) < 0:
+                    continue
                 place = Point(x, y)
-                if self.point_in_circle(point=place, center=target.coord, radius=defeat_distance) and \
-                        self.is_place_valid(self._drone, place, target):
+                if self.is_place_valid(self._drone, place, target):
                     distance_to_place = self._drone.steps_to(place) + self._drone.steps_to_turn(target.coord)
                     if min_distance_to_place is None or distance_to_place < min_distance_to_place:
                         min_distance_to_place = distance_to_place
                         optimal_place = place
-        if optimal_place:
-            dict_places[self._drone] = optimal_place
         return optimal_place
 
+    def _find_place_vector(self, target, defeat_distance):
+        """
+        Поиск места атаки: цена всех узлов сетки считается массивами, на пригодность проверяются
+        только лучшие по цене узлы, затем место уточняется более мелкой сеткой вокруг найденного.
+
+        :param target: цель
+        :param defeat_distance: дистанция поражения цели
+        :return: место (Point или None)
+        """
+        step_find = self._drone.radius * 2
+        min_x, max_x, min_y, max_y = self._place_bounds(target, defeat_distance)
+        place, cost = self._check_places(target, defeat_distance, np.arange(min_x, max_x, step_find),
+                                         np.arange(min_y, max_y, step_find))
+        if place is None:
+            return None
+
+        # уточнение между соседними узлами грубой сетки
+        step_fine = max(step_find // 4, 1)
+        xs = np.arange(max(place.x - step_find + step_fine, min_x), min(place.x + step_find, max_x + 1), step_fine)
+        ys = np.arange(max(place.y - step_find + step_fine, min_y), min(place.y + step_find, max_y + 1), step_fine)
+        fine_place, _ = self._check_places(target, defeat_distance, xs, ys, max_cost=cost)
+        return fine_place or place
+
+    def _check_places(self, target, defeat_distance, xs, ys, max_cost=None):
+        """
+        Проверить места атаки в порядке возрастания цены.
+        Проверка идет по всему списку, пока не найдется пригодное место: иначе место, которое нашел бы полный
+        перебор сетки, могло потеряться за отсечкой.
+
+        :param xs: координаты x узлов сетки
+        :param ys: координаты y узлов сетки
+        :param max_cost: проверять только места дешевле
+        :return: место (Point или None), цена места
+        """
+        x, y = np.meshgrid(xs, ys, indexing="ij")
+        x, y = x.ravel(), y.ravel()
+        in_circle = defeat_distance ** 2 - ((target.coord.x - x) ** 2 + (target.coord.y - y) ** 2) >= 0
+        x, y = x[in_circle], y[in_circle]
+        costs = steps_to_points(self._drone, x, y) + self._drone.steps_to_turn(target.coord)
+        order = np.argsort(costs, kind="stable")
+        if max_cost is not None:
+            order = order[costs[order] < max_cost]
+        # перестрелка сразу для всех мест отсекает большую часть, полная проверка - только для оставшихся
+        order = order[self.get_occlusion().hits_target(self._drone, x[order].astype(int), y[order].astype(int),
+                                                       target)]
+        for index in order:
+            place = Point(int(x[index]), int(y[index]))
+            if self.is_place_valid(self._drone, place, target):
+                return place, costs[index]
+        return None, None
+
     @staticmethod
     def point_c_at_line(a: Point, b: Point, len_ac):
         """
@@ -1283,18 +2880,6 @@ class Combat(Role):
         y = a.y + (b.y - a.y) * len_ac / len_ab
         return Point(x, y)
 
-    @staticmethod
-    def point_in_circle(point: Point, center: Point, radius):
-        """
-        Точка находится в окружности
-
-        :param point: точка
-        :param center: центр окружности
-        :param radius: радиус окружности
-        :return:
-        """
-        return radius ** 2 - ((center.x - point.x) ** 2 + (center.y - point.y) ** 2) >= 0
-
     def is_place_valid(self, drone, place: Point, target):
         """
         Место подходит для атаки?
@@ -1303,50 +2888,26 @@ class Combat(Role):
         :param place: место атаки
         :param target: цель
         """
+        self.head.scheduler.charge()
 
-        class MyDrone:
-            """
-            Вспомагательный класс, для эмуляции дронов в своих позициях
-            """
-
-            def __init__(self, drone: TrifonovDrone, coord, target):
-                self.drone = drone
-                self.coord = coord.copy()
-                self.target = target
-                self.id = drone.id
-                self.radius = drone.radius
-
-        if 0 < Combat.limit_distance < place.distance_to(drone.mothership):
+        if 0 < self.head.limit_distance < place.distance_to(drone.mothership):
             return False
 
         # не должен быть рядом чужих живых материнских короблей
-        for ship in Head.scene.motherships:
-            if ship.team == Head.team or not ship.is_alive:
+        for ship in self.head.enemies.motherships:
+            if not ship.is_alive:
                 continue
             if drone.radius + ship.radius > place.distance_to(ship.coord):
                 return False
 
-        # создаем объекты для просчета стрельбы
-        objects = [MyDrone(drone, place, target)]
-        for key_target in Combat.places_attacks.keys():
-            for drone, coord in Combat.places_attacks[key_target].items():
-                objects.append(MyDrone(drone, coord, key_target))
-
-        for obj in self._drone.scene.objects:
-            if isinstance(obj, (Drone, MotherShip)) and obj.is_alive and obj not in Combat.drones:
-                objects.append(obj)
-
         # перестрелка
-        for obj in objects:
-            if isinstance(obj, MyDrone):
-                if target != self._drone.result_shot(drone=obj.drone, place=obj.coord, target=obj.target.coord,
-                                                     objects=objects):
-                    return False
-        return True
+        return self.get_occlusion().is_valid(drone, place, target)
 
     def on_heartbeat(self):
         if self._is_new_step():
-            Combat.places_attacks.clear()
+            # занятые места и линии огня строятся заново каждый ход, найденные места бойцов (Plan) сохраняются
+            self.head.places_attacks.clear()
+            self.head.occlusion = None
 
         if (self._drone.head.radar.health(self._drone) <= self._drone.MAX_HEALTH * 0.6 and
                 self._drone.coord.distance_to(self._drone.mothership.coord) > theme.MOTHERSHIP_HEALING_DISTANCE):
@@ -1355,6 +2916,390 @@ class Combat(Role):
             self.what_to_do()
 
 
+class Profiler:
+    """
+        Класс Профилировщик.
+        Считает вызовы и время горячих точек с разбивкой по ролям и тактам.
+        По умолчанию выключен: методы оборачиваются только в enable() и восстанавливаются в disable(),
+        поэтому выключенный профилировщик ничего не стоит.
+    """
+    # горячие точки (класс, метод)
+    HOT_POINTS = (("Head", "on_heartbeat"), ("Radar", "reflect"), ("Radar", "health"),
+                  ("Router", "_get_source_elerium"), ("Router", "level_danger"), ("TrifonovDrone", "result_shot"),
+                  ("Combat", "get_place"), ("Combat", "is_place_valid"), ("Defender", "get_position"))
+    # события дрона, по ним определяется роль, на которую записывается время
+    ENTRY_POINTS = ("on_born", "on_heartbeat", "on_stop_at_point", "on_stop_at_asteroid", "on_stop_at_mothership",
+                    "on_load_complete", "on_unload_complete")
+
+    is_enabled = False
+    # {(роль, метод): [вызовов, время всего, собственное время]}
+    stats = {}
+    # {такт: {(роль, метод): время всего}}
+    per_tick = {}
+    # {"роль;метод;...;метод": собственное время}
+    stacks = {}
+    _originals = []
+    _stack = []
+    _role = None
+    _drone = None
+    _dump_every = None
+    _dump_path = None
+    _dump_kind = None
+    _dump_tick = None
+
+    @staticmethod
+    def enable(dump_every=None, dump_path="profile", dump_kind="summary"):
+        """
+        Включить профилирование
+
+        :param dump_every: сбрасывать результаты в файл каждые dump_every тактов
+        :param dump_path: имя файла без расширения
+        :param dump_kind: "summary" - таблица, "folded" - свернутые стеки для flame graph
+        """
+        if Profiler.is_enabled:
+            return
+        Profiler.is_enabled = True
+        Profiler.reset()
+        Profiler._dump_every, Profiler._dump_path, Profiler._dump_kind = dump_every, dump_path, dump_kind
+        classes = {cls.__name__: cls for cls in (TrifonovDrone, Head, Radar, Router, Combat, Defender)}
+        points = [(classes[class_name], name, False) for class_name, name in Profiler.HOT_POINTS]
+        points += [(TrifonovDrone, name, True) for name in Profiler.ENTRY_POINTS]
+        for cls, name, is_entry in points:
+            attribute = cls.__dict__[name]
+            Profiler._originals.append((cls, name, attribute))
+            label = "{}.{}".format(cls.__name__, name)
+            if isinstance(attribute, (staticmethod, classmethod)):
+                setattr(cls, name, type(attribute)(Profiler._wrap(label, attribute.__func__, is_entry)))
+            else:
+                setattr(cls, name, Profiler._wrap(label, attribute, is_entry))
+
+    @staticmethod
+    def disable():
+        """
+        Выключить профилирование, исходные методы восстанавливаются
+        """
+        for cls, name, attribute in reversed(Profiler._originals):
+            setattr(cls, name, attribute)
+        Profiler._originals.clear()
+        Profiler._stack.clear()
+        Profiler.is_enabled = False
+
+    @staticmethod
+    def reset():
+        """
+        Сбросить накопленные результаты
+        """
+        Profiler.stats = {}
+        Profiler.per_tick = {}
+        Profiler.stacks = {}
+
+    @staticmethod
+    def _wrap(label, function, is_entry):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = Profiler._stack
+            if is_entry and not stack:
+                Profiler._drone = args[0]
+                role = args[0].role
+                Profiler._role = type(role).__name__ if role is not None else "-"
+            # [метод, время вложенных вызовов]
+            stack.append([label, 0.0])
+            begin = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - begin
+                _, nested = stack.pop()
+                Profiler._record(label, elapsed, elapsed - nested)
+                if stack:
+                    stack[-1][1] += elapsed
+                else:
+                    Profiler._dump_periodically()
+        return wrapper
+
+    @staticmethod
+    def _record(label, elapsed, own):
+        key = (Profiler._role, label)
+        stat = Profiler.stats.get(key)
+        if stat is None:
+            stat = Profiler.stats[key] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] += own
+        tick = Profiler.per_tick.setdefault(Profiler._tick(), {})
+        tick[key] = tick.get(key, 0.0) + elapsed
+        path = ";".join([Profiler._role] + [frame[0] for frame in Profiler._stack] + [label])
+        Profiler.stacks[path] = Profiler.stacks.get(path, 0.0) + own
+
+    @staticmethod
+    def _tick():
+        """
+        Такт команды дрона, чье событие обрабатывается; до рождения дрона (-1)
+        """
+        head = Profiler._drone.head if Profiler._drone is not None else None
+        return head.tick() if head is not None else -1
+
+    @staticmethod
+    def _dump_periodically():
+        tick = Profiler._tick()
+        if not Profiler._dump_every or tick == Profiler._dump_tick or tick % Profiler._dump_every:
+            return
+        Profiler._dump_tick = tick
+        Profiler.dump(Profiler._dump_path, Profiler._dump_kind)
+
+    @staticmethod
+    def heaviest_ticks(count=10):
+        """
+        Самые тяжелые такты: время обработки событий дронов по ролям
+
+        :param count: сколько тактов вернуть
+        :return: [(такт, время всего, {роль: время}), ...]
+        """
+        entries = {"TrifonovDrone.{}".format(name) for name in Profiler.ENTRY_POINTS}
+        ticks = []
+        for tick, times in Profiler.per_tick.items():
+            roles = {}
+            for (role, label), elapsed in times.items():
+                if label in entries:
+                    roles[role] = roles.get(role, 0.0) + elapsed
+            ticks.append((tick, sum(roles.values()), roles))
+        ticks.sort(key=lambda x: -x[1])
+        return ticks[:count]
+
+    @staticmethod
+    def summary():
+        """
+        Таблица: роль, метод, вызовов, время всего и собственное (мс), среднее на вызов (мкс).
+        Затем самые тяжелые такты с разбивкой по ролям.
+
+        :return: текст
+        """
+        lines = ["{:<10} {:<34} {:>9} {:>11} {:>11} {:>10}".format("role", "method", "calls", "total ms",
+                                                                     "own ms", "mean us")]
+        for (role, label), (count, total, own) in sorted(Profiler.stats.items(), key=lambda x: -x[1][1]):
+            lines.append("{:<10} {:<34} {:>9} {:>11.1f} {:>11.1f} {:>10.1f}".format(
+                role, label, count, total * 1000, own * 1000, total / count * 1e6))
+        lines.append("")
+        lines.append("{:<10} {:>11}  {}".format("tick", "total ms", "roles ms"))
+        for tick, total, roles in Profiler.heaviest_ticks():
+            lines.append("{:<10} {:>11.1f}  {}".format(tick, total * 1000, ", ".join(
+                "{} {:.1f}".format(role, elapsed * 1000) for role, elapsed in sorted(roles.items()))))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def folded():
+        """
+        Свернутые стеки для flame graph (flamegraph.pl, speedscope): "стек собственное_время_мкс"
+
+        :return: текст
+        """
+        return "".join("{} {}\n".format(path, round(own * 1e6)) for path, own in sorted(Profiler.stacks.items()))
+
+    @staticmethod
+    def dump(path="profile", kind="summary"):
+        """
+        Записать результаты в файл path.txt (summary) или path.folded (folded)
+        """
+        if kind == "folded":
+            text, extension = Profiler.folded(), ".folded"
+        else:
+            text, extension = Profiler.summary(), ".txt"
+        with open(path + extension, "w") as file:
+            file.write(text)
+
+
+class TraceRecorder:
+    """
+        Класс ЗаписьРешений.
+        Пишет в двоичный файл по одной записи за такт: роль каждого своего дрона, выбранное место назначения,
+        цель и место атаки, прогноз здоровья, а также прогнозы попаданий радара.
+        Записи упаковываются в игровом цикле, а пишутся в файл отдельным потоком через очередь ограниченной длины.
+        Как и Profiler, по умолчанию выключен и методы оборачивает только в enable().
+        Записанный файл читается генератором replay(), расхождения двух файлов - diff().
+    """
+    MAGIC = b"TRT1"
+    # такт, дронов, попаданий
+    TICK = struct.Struct("<iHH")
+    # id дрона, роль, id места назначения, id цели, место атаки (x, y), прогноз здоровья
+    DRONE = struct.Struct("<iBiifff")
+    # id объекта, ходов до попадания, урон
+    HIT = struct.Struct("<iHH")
+    # коды ролей, 0 - без роли
+    ROLES = (None, "Collector", "Defender", "Combat")
+    # источники решений (класс, метод)
+    POINTS = (("Router", "destination"), ("Combat", "get_place"), ("Defender", "get_target"))
+
+    is_enabled = False
+    _originals = []
+    _queue = None
+    _thread = None
+    _head = None
+    _step = None
+    _tick = None
+    # решения текущего такта {id дрона: [id места назначения, id цели, x, y]}
+    _decisions = {}
+
+    @staticmethod
+    def enable(path="trace.bin", buffer_size=256):
+        """
+        Включить запись
+
+        :param path: файл записи
+        :param buffer_size: сколько записей может ждать в очереди, при заполнении игровой цикл ждет запись в файл
+        """
+        if TraceRecorder.is_enabled:
+            return
+        TraceRecorder.is_enabled = True
+        TraceRecorder._head, TraceRecorder._step, TraceRecorder._tick = None, None, None
+        TraceRecorder._decisions = {}
+        TraceRecorder._queue = Queue(maxsize=buffer_size)
+        TraceRecorder._thread = Thread(target=TraceRecorder._write, args=(path, TraceRecorder._queue), daemon=True)
+        TraceRecorder._thread.start()
+        TraceRecorder._queue.put(TraceRecorder.MAGIC)
+
+        classes = {cls.__name__: cls for cls in (Router, Combat, Defender)}
+        points = [(classes[class_name], name, TraceRecorder._wrap_decision)
+                  for class_name, name in TraceRecorder.POINTS]
+        points.append((TrifonovDrone, "on_heartbeat", TraceRecorder._wrap_heartbeat))
+        for cls, name, wrap in points:
+            function = cls.__dict__[name]
+            TraceRecorder._originals.append((cls, name, function))
+            setattr(cls, name, wrap(name, function))
+
+    @staticmethod
+    def disable():
+        """
+        Выключить запись: последний такт записывается, файл закрывается, исходные методы восстанавливаются
+        """
+        if not TraceRecorder.is_enabled:
+            return
+        for cls, name, function in reversed(TraceRecorder._originals):
+            setattr(cls, name, function)
+        TraceRecorder._originals.clear()
+        TraceRecorder._flush()
+        TraceRecorder._queue.put(None)
+        TraceRecorder._thread.join()
+        TraceRecorder._queue, TraceRecorder._thread = None, None
+        TraceRecorder.is_enabled = False
+
+    @staticmethod
+    def _write(path, queue):
+        """
+        Поток записи в файл
+        """
+        with open(path, "wb") as file:
+            while True:
+                data = queue.get()
+                if data is None:
+                    return
+                file.write(data)
+
+    @staticmethod
+    def _wrap_heartbeat(name, function):
+        @wraps(function)
+        def wrapper(drone):
+            # ход до учета такта дрона одинаков для всех дронов одного такта
+            if drone.head is not None:
+                step = drone.head.step()
+                if step != TraceRecorder._step:
+                    TraceRecorder._flush()
+                    TraceRecorder._step = step
+            function(drone)
+            TraceRecorder._head = drone.head
+            TraceRecorder._tick = drone.head.tick()
+        return wrapper
+
+    @staticmethod
+    def _wrap_decision(name, function):
+        @wraps(function)
+        def wrapper(obj, *args, **kwargs):
+            result = function(obj, *args, **kwargs)
+            drone = obj._drone
+            decision = TraceRecorder._decisions.setdefault(drone.id, [-1, -1, float("nan"), float("nan")])
+            if name == "destination":
+                if not kwargs.get("assume", args[0] if args else False) and result is not None:
+                    decision[0] = result.id
+            elif name == "get_place":
+                target = kwargs.get("target", args[0] if args else None)
+                decision[1] = target.id if target is not None else -1
+                if result is not None:
+                    decision[2], decision[3] = result.x, result.y
+            elif result is not None:
+                decision[1] = result.id
+            return result
+        return wrapper
+
+    @staticmethod
+    def _flush():
+        """
+        Упаковать решения прошедшего такта и поставить в очередь записи
+        """
+        head = TraceRecorder._head
+        if head is None or TraceRecorder._tick is None:
+            return
+        records = []
+        for drone in head.drones:
+            role = type(drone.role).__name__ if drone.role is not None else None
+            role = TraceRecorder.ROLES.index(role) if role in TraceRecorder.ROLES else 0
+            destination, target, x, y = TraceRecorder._decisions.get(drone.id, (-1, -1, float("nan"), float("nan")))
+            records.append(TraceRecorder.DRONE.pack(drone.id, role, destination, target, x, y,
+                                                    head.radar.health(drone)))
+        hits = [TraceRecorder.HIT.pack(obj.id, max(steps, 0), int(damage)) for obj, steps, damage in head.radar.hits]
+        TraceRecorder._queue.put(TraceRecorder.TICK.pack(TraceRecorder._tick, len(records), len(hits)) +
+                                 b"".join(records) + b"".join(hits))
+        TraceRecorder._decisions = {}
+        TraceRecorder._tick = None
+
+    @staticmethod
+    def replay(path):
+        """
+        Прочитать запись
+
+        :param path: файл записи
+        :return: генератор словарей по тактам {"tick": такт, "drones": {id дрона: {"role", "destination", "target",
+         "place", "health"}}, "hits": [(id объекта, ходов до попадания, урон), ...]}
+        """
+        with open(path, "rb") as file:
+            if file.read(len(TraceRecorder.MAGIC)) != TraceRecorder.MAGIC:
+                raise ValueError("{} не является записью решений".format(path))
+            while True:
+                data = file.read(TraceRecorder.TICK.size)
+                if len(data) < TraceRecorder.TICK.size:
+                    return
+                tick, count_drones, count_hits = TraceRecorder.TICK.unpack(data)
+                drones = {}
+                for fields in TraceRecorder.DRONE.iter_unpack(file.read(TraceRecorder.DRONE.size * count_drones)):
+                    drone_id, role, destination, target, x, y, health = fields
+                    drones[drone_id] = {
+                        "role": TraceRecorder.ROLES[role],
+                        "destination": destination if destination >= 0 else None,
+                        "target": target if target >= 0 else None,
+                        "place": None if isnan(x) else (x, y),
+                        "health": health,
+                    }
+                hits = list(TraceRecorder.HIT.iter_unpack(file.read(TraceRecorder.HIT.size * count_hits)))
+                yield {"tick": tick, "drones": drones, "hits": hits}
+
+    @staticmethod
+    def diff(path_1, path_2):
+        """
+        Расхождения решений двух записей, такты сопоставляются по номеру
+
+        :return: генератор (такт, id дрона, поле, значение в первой записи, значение во второй)
+        """
+        for record_1, record_2 in zip(TraceRecorder.replay(path_1), TraceRecorder.replay(path_2)):
+            tick = record_1["tick"]
+            if tick != record_2["tick"]:
+                yield tick, None, "tick", tick, record_2["tick"]
+                return
+            for drone_id in sorted(set(record_1["drones"]) | set(record_2["drones"])):
+                drone_1 = record_1["drones"].get(drone_id, {})
+                drone_2 = record_2["drones"].get(drone_id, {})
+                for field in ("role", "destination", "target", "place"):
+                    if drone_1.get(field) != drone_2.get(field):
+                        yield tick, drone_id, field, drone_1.get(field), drone_2.get(field)
+
+
 def is_point_eq(point_1: Point, point_2: Point):
     """
     Проверяет равенство(идентичность) точек
@@ -1375,4 +3320,262 @@ def is_coord_eq(coord_1: Point, coord_2: Point):
     return delta <= theme.CARGO_TRANSITION_DISTANCE
 
 
+def distance_to_segment(x, y, a: Point, b: Point):
+    """
+    Растояние от точки до отрезка
+
+    :param x: координата x точки
+    :param y: координата y точки
+    :param a: начало отрезка
+    :param b: конец отрезка
+    """
+    delta_x = b.x - a.x
+    delta_y = b.y - a.y
+    length = delta_x ** 2 + delta_y ** 2
+    t = ((x - a.x) * delta_x + (y - a.y) * delta_y) / length if length else 0
+    t = min(max(t, 0), 1)
+    return ((a.x + t * delta_x - x) ** 2 + (a.y + t * delta_y - y) ** 2) ** .5
+
+
+def vector_between(x_1, y_1, x_2, y_2, module=None):
+    """
+    Вектор из точки 1 в точку 2, как Vector.from_points, но без создания объектов
+
+    :param module: длина вектора, None - без изменения
+    :return: x, y вектора
+    """
+    x = float(x_2 - x_1)
+    y = float(y_2 - y_1)
+    if module:
+        current_module = sqrt(x ** 2 + y ** 2)
+        if current_module:
+            x *= module / current_module
+            y *= module / current_module
+    return x, y
+
+
+def module_of(x, y):
+    """
+    Длина вектора, как Vector.module
+    """
+    return sqrt(x ** 2 + y ** 2)
+
+
+def direction_of(x, y):
+    """
+    Направление вектора в градусах [0, 360), как Vector.direction.
+    Считается через atan, а не atan2, как в движке: atan2 расходится в последних битах, а этого хватает,
+    чтобы ceil в расчете шагов разворота дал другое число.
+    """
+    if x == 0:
+        return 90 if y >= 0 else 270
+    direction = atan(y / x) * (180 / pi)
+    if x < 0:
+        direction += 180
+    return direction % 360
+
+
+def distance_between(x_1, y_1, x_2, y_2):
+    """
+    Растояние между точками, как Point.distance_to
+    """
+    return sqrt((x_1 - x_2) ** 2 + (y_1 - y_2) ** 2)
+
+
+def turn_angle(direction_1, direction_2):
+    """
+    Угол разворота между направлениями, от 0 до 180
+    """
+    delta = abs(direction_1 - direction_2)
+    return delta if delta <= 180 else 360 - delta
+
+
+def directions_of(x, y):
+    """
+    Векторизованный direction_of
+
+    :param x: массив x векторов
+    :param y: массив y векторов
+    :return: массив направлений
+    """
+    is_vertical = x == 0
+    ratio = np.divide(y, x, out=np.zeros_like(y), where=~is_vertical)
+    # math.atan, а не np.arctan: векторный арктангенс numpy расходится с движком в последних битах
+    direction = np.fromiter(map(atan, ratio.ravel().tolist()), dtype=float, count=ratio.size).reshape(ratio.shape)
+    direction = direction * (180 / np.pi) + np.where(x < 0, 180, 0)
+    return np.where(is_vertical, np.where(y >= 0, 90, 270), direction) % 360
+
+
+def turn_angles(directions, direction):
+    """
+    Векторизованный turn_angle
+
+    :param directions: направления (число или массив)
+    :param direction: направление
+    :return: массив углов
+    """
+    delta = np.abs(np.asarray(directions) - direction)
+    return np.where(delta <= 180, delta, 360 - delta)
+
+
+def steps_to_points(drone: TrifonovDrone, x, y):
+    """
+    Векторизованный TrifonovDrone.steps_to: растояние в шагах до точек с учетом разворота
+
+    :param drone: дрон
+    :param x: массив координат x точек
+    :param y: массив координат y точек
+    :return: массив шагов
+    """
+    delta_x = x - drone.coord.x
+    delta_y = y - drone.coord.y
+    distance = np.sqrt(delta_x ** 2 + delta_y ** 2)
+    # вектор, как в Vector.from_points(drone.coord, point, module=drone.SPEED)
+    is_far = distance != 0
+    scale = np.divide(drone.SPEED, distance, out=np.ones_like(distance), where=is_far)
+    vector_x = delta_x * scale
+    vector_y = delta_y * scale
+    module = np.sqrt(vector_x ** 2 + vector_y ** 2)
+    count_steps = np.ceil(np.divide(distance, module, out=np.zeros_like(distance), where=is_far))
+
+    count_steps += np.ceil(turn_angles(directions_of(vector_x, vector_y), drone.direction) / drone.TURN_SPEED)
+    return np.where(is_far, count_steps, 0)
+
+
+def objects_arrays(objects):
+    """
+    Массивы центров, радиусов и id объектов для векторизованных расчетов
+
+    :param objects: объекты
+    :return: центры (N, 2), радиусы (N,), id (N,)
+    """
+    centers = np.array([(obj.coord.x, obj.coord.y) for obj in objects], dtype=float).reshape(-1, 2)
+    radii = np.array([obj.radius for obj in objects], dtype=float)
+    ids = np.array([obj.id for obj in objects], dtype=np.int64)
+    return centers, radii, ids
+
+
+def first_hits(places, targets, shooter_ids, radius_projectile, centers, radii, ids):
+    """
+    Векторизованный расчет результатов выстрелов.
+    Повторяет вычисления TrifonovDrone.result_shot, в том числе порядок операций с плавающей точкой.
+
+    :param places: места стрельбы (S, 2)
+    :param targets: цели (S, 2)
+    :param shooter_ids: id стреляющих дронов (S,)
+    :param radius_projectile: радиус снаряда, число или (S,)
+    :param centers: центры объектов (N, 2)
+    :param radii: радиусы объектов (N,)
+    :param ids: id объектов (N,)
+    :return: индексы объектов, в которые попали, -1 - ни в кого (S,)
+    """
+    places = np.asarray(places, dtype=float).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+    if not len(ids):
+        return np.full(len(places), -1)
+    shooter_ids = np.asarray(shooter_ids).reshape(-1, 1)
+    radius_projectile = np.asarray(radius_projectile, dtype=float).reshape(-1, 1)
+    place_x, place_y = places[:, :1], places[:, 1:]
+    target_x, target_y = targets[:, :1], targets[:, 1:]
+    obj_x, obj_y = centers[:, 0], centers[:, 1]
+
+    # вектор линии огня, как в Vector.from_points(place, target, radius_projectile)
+    vector_x = target_x - place_x
+    vector_y = target_y - place_y
+    module = np.sqrt(vector_x ** 2 + vector_y ** 2)
+    scale = np.divide(radius_projectile, module, out=np.ones_like(module), where=module != 0)
+    vector_x = vector_x * scale
+    vector_y = vector_y * scale
+
+    x_min = np.minimum(place_x, target_x) - radius_projectile
+    x_max = np.maximum(place_x, target_x) + radius_projectile
+    y_min = np.minimum(place_y, target_y) - radius_projectile
+    y_max = np.maximum(place_y, target_y) + radius_projectile
+    in_box = ((ids != shooter_ids)
+              & (x_min <= obj_x + radii) & (x_max >= obj_x - radii)
+              & (y_min <= obj_y + radii) & (y_max >= obj_y - radii))
+
+    # проэкция на линию огня
+    length = vector_x ** 2 + vector_y ** 2
+    is_line = length != 0
+    t = vector_x * (obj_x - place_x) + vector_y * (obj_y - place_y)
+    t = np.divide(t, length, out=np.zeros_like(t), where=is_line)
+    p_x = np.where(is_line, vector_x * t + place_x, place_x)
+    p_y = np.where(is_line, vector_y * t + place_y, place_y)
+
+    summa_radius = radii + radius_projectile
+    delta_x = np.abs(obj_x - p_x)
+    delta_y = np.abs(obj_y - p_y)
+    distance = np.sqrt((p_x - obj_x) ** 2 + (p_y - obj_y) ** 2)
+    is_hit = (in_box & ~((delta_x > summa_radius) & (delta_y > summa_radius))
+              & (np.trunc(summa_radius - distance) > 1))
+
+    # ближайший к месту стрельбы из пораженных объектов
+    key = np.sqrt((place_x - obj_x) ** 2 + (place_y - obj_y) ** 2) - radii
+    key = np.where(is_hit, key, np.inf)
+    indexes = np.argmin(key, axis=1)
+    return np.where(is_hit.any(axis=1), indexes, -1)
+
+
+def assignment(costs):
+    """
+    Задача о назначениях, венгерский алгоритм.
+    Каждой строке назначается не более одного столбца, каждому столбцу - не более одной строки,
+    суммарная цена назначения минимальна.
+
+    :param costs: матрица цен (N, M)
+    :return: индексы столбцов, назначенных строкам, -1 - строке столбец не достался (N,)
+    """
+    costs = np.asarray(costs, dtype=float)
+    is_transposed = costs.shape[0] > costs.shape[1]
+    if is_transposed:
+        costs = costs.T
+    count_rows, count_columns = costs.shape
+    result = np.full(count_rows, -1)
+    if not count_rows:
+        return result if not is_transposed else np.full(count_columns, -1)
+
+    # потенциалы строк и столбцов, нулевой столбец - фиктивный
+    u = np.zeros(count_rows + 1)
+    v = np.zeros(count_columns + 1)
+    # row_of[j] - строка (с единицы), назначенная столбцу j
+    row_of = np.zeros(count_columns + 1, dtype=int)
+    way = np.zeros(count_columns + 1, dtype=int)
+    for row in range(1, count_rows + 1):
+        row_of[0] = row
+        column = 0
+        min_reduced = np.full(count_columns + 1, np.inf)
+        used = np.zeros(count_columns + 1, dtype=bool)
+        while row_of[column]:
+            used[column] = True
+            current_row = row_of[column]
+            free = ~used
+            reduced = costs[current_row - 1] - u[current_row] - v[1:]
+            better = free[1:] & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free, min_reduced, np.inf)
+            candidates[0] = np.inf
+            next_column = int(np.argmin(candidates))
+            delta = candidates[next_column]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_reduced[free] -= delta
+            column = next_column
+        # чередующийся путь
+        while column:
+            previous = way[column]
+            row_of[column] = row_of[previous]
+            column = previous
+
+    for column in range(1, count_columns + 1):
+        if row_of[column]:
+            result[row_of[column] - 1] = column - 1
+    if not is_transposed:
+        return result
+    transposed = np.full(count_columns, -1)
+    transposed[result] = np.arange(count_rows)
+    return transposed
+
+
 drone_class = TrifonovDrone